@@ -1,171 +1,2607 @@
 import sys
 import os
+import argparse
+import csv
+import json
+import hashlib
+import multiprocessing
+import shutil
+import subprocess
+import tempfile
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
 import cv2
 import numpy as np
 from PyQt6.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout, 
                             QPushButton, QLabel, QFileDialog, QScrollArea, 
                             QGridLayout, QCheckBox, QMessageBox, QTextEdit,
-                            QSlider, QGroupBox, QFormLayout, QComboBox)
-from PyQt6.QtGui import QPixmap, QImage
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+                            QSlider, QGroupBox, QFormLayout, QComboBox,
+                            QSpinBox)
+from PyQt6.QtGui import QPixmap, QImage, QPainter, QColor
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal
 import face_recognition
+import dlib
 
-class FaceDetectionThread(QThread):
-    progress_update = pyqtSignal(int)
-    detection_finished = pyqtSignal(list, list, list, list, int)
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; benchmarks then report no peak memory
+    resource = None
 
-    def __init__(self, video_path, face_tolerance=0.7, sample_interval=1):
-        super().__init__()
+# Past this many frames it is cheaper to seek than to grab through the gap
+SEEK_THRESHOLD_FRAMES = 120
+
+# Items a pipeline stage may run ahead of the stage consuming them
+PIPELINE_QUEUE_SIZE = 8
+
+# Progress snapshots are sent at most this often (seconds)
+PROGRESS_INTERVAL = 0.1
+# Lines kept in the GUI status log
+LOG_HISTORY_LIMIT = 500
+
+# Frames are scaled to roughly this many pixels for detection unless told otherwise
+DEFAULT_PIXEL_BUDGET = 640 * 360
+# Smallest face, in detection pixels, the HOG detector finds with one upsample
+HOG_MIN_FACE_SIZE = 40
+
+
+def detection_scale(width, height, pixel_budget=DEFAULT_PIXEL_BUDGET, target_face_size=None):
+    # Scale factor for detection frames: just large enough for faces of target_face_size
+    # source pixels to be found, otherwise sized to the pixel budget. Never upscales.
+    if target_face_size:
+        return min(1.0, HOG_MIN_FACE_SIZE / target_face_size)
+    if width <= 0 or height <= 0:
+        return 1.0
+    return min(1.0, (pixel_budget / (width * height)) ** 0.5)
+
+
+def scaled_size(width, height, scale):
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def sampling_step(fps, sample_interval=1, analyses_per_second=None):
+    if analyses_per_second:
+        return max(1, int(round(fps / analyses_per_second))) if fps > 0 else 1
+    return max(1, sample_interval)
+
+
+def iter_sampled_frames(cap, sample_interval=1, analyses_per_second=None, start_frame=0):
+    # Frames that are not analysed are only grabbed, never decoded to BGR
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if analyses_per_second and fps > 0:
+        yield from _iter_frames_by_time(cap, fps, analyses_per_second, start_frame)
+        return
+
+    sample_interval = max(1, sample_interval)
+    frame_count = 0
+    if start_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        frame_count = start_frame
+    while cap.isOpened():
+        if not cap.grab():
+            break
+
+        if frame_count % sample_interval == 0:
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            yield frame_count, frame
+
+        frame_count += 1
+
+
+def _iter_frames_by_time(cap, fps, analyses_per_second, start_frame=0):
+    step_ms = 1000.0 / analyses_per_second
+    # First sample time at or after start_frame
+    target_ms = np.ceil(start_frame * 1000.0 / fps / step_ms - 1e-9) * step_ms if start_frame else 0.0
+    position = 0
+    while cap.isOpened():
+        target_frame = int(round(target_ms * fps / 1000.0))
+        if target_frame - position > SEEK_THRESHOLD_FRAMES:
+            cap.set(cv2.CAP_PROP_POS_MSEC, target_ms)
+            position = int(round(cap.get(cv2.CAP_PROP_POS_FRAMES)))
+
+        while position < target_frame:
+            if not cap.grab():
+                return
+            position += 1
+
+        if not cap.grab():
+            break
+        ret, frame = cap.retrieve()
+        if not ret:
+            break
+        yield position, frame
+
+        position += 1
+        target_ms += step_ms
+
+
+def advance_to(cap, position, target):
+    # Moves the capture so the next read returns frame `target`
+    if target < position or target - position > SEEK_THRESHOLD_FRAMES:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        return target
+
+    while position < target and cap.grab():
+        position += 1
+    return position
+
+
+def merge_runs(starts, ends, merge_gap=0):
+    # Sorts inclusive (start, end) runs and joins those that overlap, touch or
+    # are at most merge_gap frames apart
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    if len(starts) == 0:
+        return starts, ends
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = starts[1:] - reach[:-1] - 1 > merge_gap
+    return starts[first], np.maximum.reduceat(ends, np.flatnonzero(first))
+
+
+class SegmentList:
+    # Sorted, disjoint inclusive (start, end) frame runs kept in two arrays
+
+    def __init__(self, starts=(), ends=()):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+
+    @classmethod
+    def from_frames(cls, frames, sample_interval=1, total_frames=None):
+        # A sampled detection stands for the frames up to the next sample
+        frames = np.unique(np.asarray(frames, dtype=np.int64))
+        ends = frames + max(1, sample_interval) - 1
+        if total_frames:
+            ends = np.minimum(ends, total_frames - 1)
+        return cls(*merge_runs(frames, ends))
+
+    @classmethod
+    def union(cls, *segment_lists):
+        if not segment_lists:
+            return cls()
+        return cls(*merge_runs(np.concatenate([segments.starts for segments in segment_lists]),
+                               np.concatenate([segments.ends for segments in segment_lists])))
+
+    @classmethod
+    def intersection(cls, *segment_lists):
+        # Sweeps the run boundaries of all lists and keeps where every list is present
+        if not segment_lists:
+            return cls()
+        positions = np.concatenate([segments.starts for segments in segment_lists] +
+                                   [segments.ends + 1 for segments in segment_lists])
+        deltas = np.concatenate([np.ones(len(segments), dtype=np.int64) for segments in segment_lists] +
+                                [-np.ones(len(segments), dtype=np.int64) for segments in segment_lists])
+        positions, inverse = np.unique(positions, return_inverse=True)
+        covered = np.cumsum(np.bincount(inverse, weights=deltas, minlength=len(positions))) >= len(segment_lists)
+        pieces = np.flatnonzero(covered[:-1])
+        return cls(*merge_runs(positions[pieces], positions[pieces + 1] - 1))
+
+    def padded(self, padding=0, merge_gap=0, total_frames=None):
+        starts = np.maximum(self.starts - padding, 0)
+        ends = self.ends + padding
+        if total_frames:
+            ends = np.minimum(ends, total_frames - 1)
+        return SegmentList(*merge_runs(starts, ends, merge_gap))
+
+    def find(self, frame):
+        # Index of the first segment that ends at or after frame
+        return int(np.searchsorted(self.ends, frame))
+
+    def frame_count(self):
+        return int((self.ends - self.starts + 1).sum())
+
+    def ranges(self):
+        return list(zip(self.starts.tolist(), self.ends.tolist()))
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class PersonTimeline:
+    # Run-length segments of every person of a detection result, built on first
+    # use. A selection is the union of its people's segments, or with together
+    # set, the stretches where all of them are on screen at once.
+
+    def __init__(self, detections, unique_faces, sample_interval=1, total_frames=None):
+        self.frame_indices = detections.frame_indices
+        self.unique_faces = unique_faces
+        self.sample_interval = sample_interval
+        self.total_frames = total_frames
+        self.people = {}
+
+    def person(self, person_index):
+        segments = self.people.get(person_index)
+        if segments is None:
+            frames = self.frame_indices[self.unique_faces[person_index]['indices']]
+            segments = SegmentList.from_frames(frames, self.sample_interval, self.total_frames)
+            self.people[person_index] = segments
+        return segments
+
+    def select(self, person_indices, together=False):
+        segment_lists = [self.person(person_index) for person_index in sorted(person_indices)]
+        if together:
+            return SegmentList.intersection(*segment_lists)
+        return SegmentList.union(*segment_lists)
+
+
+_STAGE_DONE = object()
+
+
+def threaded_stage(source, maxsize=PIPELINE_QUEUE_SIZE):
+    # Runs an iterable on its own thread and yields its items through a bounded
+    # queue, so the producer keeps working while the consumer is busy and blocks
+    # once it is maxsize items ahead. Producer errors are re-raised here.
+    items = queue.Queue(maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in source:
+                if not put((item, None)):
+                    break
+        except Exception as error:
+            put((_STAGE_DONE, error))
+        else:
+            put((_STAGE_DONE, None))
+        finally:
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _STAGE_DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def encode_face_batch(images, locations):
+    # Aligns every face of the batch to a 150x150 chip, as face_encodings does,
+    # and runs the encoder network once on the whole stack of chips
+    chips = []
+    for image, face_locations in zip(images, locations):
+        for top, right, bottom, left in face_locations:
+            landmarks = face_recognition.api.pose_predictor_5_point(image, dlib.rectangle(left, top, right, bottom))
+            chips.append(dlib.get_face_chip(image, landmarks, size=150, padding=0.25))
+    descriptors = face_recognition.api.face_encoder.compute_face_descriptor(chips) if chips else []
+
+    encodings = []
+    start = 0
+    for face_locations in locations:
+        encodings.append([np.array(descriptor) for descriptor in descriptors[start:start + len(face_locations)]])
+        start += len(face_locations)
+    return encodings
+
+
+class HogBackend:
+    # face_recognition's default HOG detector. It has no batch mode, so the
+    # frames of a batch are located one by one; their faces are encoded together.
+    name = "hog"
+
+    def locate(self, images):
+        return [face_recognition.face_locations(image) for image in images]
+
+    def encode(self, images, locations):
+        return encode_face_batch(images, locations)
+
+
+class CnnBackend(HogBackend):
+    # dlib's CNN detector through batch_face_locations, one call per image size
+    name = "cnn"
+
+    def locate(self, images):
+        by_shape = {}
+        for index, image in enumerate(images):
+            by_shape.setdefault(image.shape, []).append(index)
+
+        locations = [None] * len(images)
+        for indices in by_shape.values():
+            found = face_recognition.batch_face_locations([images[i] for i in indices], batch_size=len(indices))
+            for index, face_locations in zip(indices, found):
+                locations[index] = face_locations
+        return locations
+
+
+# YuNet detectors created in this process, keyed by model path and thread
+_yunet_detectors = {}
+
+
+class YuNetBackend(HogBackend):
+    # OpenCV's YuNet DNN detector (cv2.FaceDetectorYN). OpenCV does not ship the
+    # model, so the path of face_detection_yunet_*.onnx has to be given.
+    name = "yunet"
+
+    def __init__(self, model_path, score_threshold=0.8):
+        self.model_path = model_path
+        self.score_threshold = score_threshold
+
+    def locate(self, images):
+        key = (self.model_path, threading.get_ident())
+        detector = _yunet_detectors.get(key)
+        if detector is None:
+            detector = cv2.FaceDetectorYN.create(self.model_path, "", (320, 320), self.score_threshold)
+            _yunet_detectors[key] = detector
+
+        locations = []
+        for image in images:
+            height, width = image.shape[:2]
+            detector.setInputSize((width, height))
+            _, faces = detector.detect(cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+            face_locations = []
+            for x, y, w, h in (faces[:, :4] if faces is not None else []):
+                top, left = max(int(y), 0), max(int(x), 0)
+                bottom, right = min(int(y + h), height), min(int(x + w), width)
+                if bottom > top and right > left:
+                    face_locations.append((top, right, bottom, left))
+            locations.append(face_locations)
+        return locations
+
+
+DETECTION_BACKENDS = ("hog", "cnn", "yunet")
+
+
+def make_backend(name="hog", model_path=None):
+    if name == "cnn":
+        return CnnBackend()
+    if name == "yunet":
+        if not model_path or not os.path.exists(model_path):
+            raise ValueError("The YuNet detector needs the path of its .onnx model file.")
+        return YuNetBackend(model_path)
+    return HogBackend()
+
+
+def locate_faces(backend, rgb_small_frames, min_face_size=0, regions=None):
+    # Locates the faces of a batch of frames with a single backend call. A
+    # frame with regions is only searched inside them (each crop is one image).
+    crops = []
+    offsets = []
+    for index, (frame, frame_regions) in enumerate(zip(rgb_small_frames, regions or [None] * len(rgb_small_frames))):
+        if frame_regions is None:
+            crops.append(frame)
+            offsets.append((index, 0, 0))
+            continue
+        for region_top, region_right, region_bottom, region_left in frame_regions:
+            crops.append(np.ascontiguousarray(frame[region_top:region_bottom, region_left:region_right]))
+            offsets.append((index, region_top, region_left))
+
+    locations = [[] for _ in rgb_small_frames]
+    for (index, offset_y, offset_x), face_locations in zip(offsets, backend.locate(crops) if crops else []):
+        for top, right, bottom, left in face_locations:
+            # Faces too small to identify reliably are not worth an encoding
+            if min_face_size and (bottom - top < min_face_size or right - left < min_face_size):
+                continue
+            locations[index].append((top + offset_y, right + offset_x, bottom + offset_y, left + offset_x))
+    return locations
+
+
+def encode_faces(backend, rgb_small_frames, locations):
+    if not any(locations):
+        return [[] for _ in locations]
+    return backend.encode(rgb_small_frames, locations)
+
+
+# Shared-memory blocks attached by a worker process, keyed by block name
+_attached_buffers = {}
+
+
+def _shared_frame(name, shape):
+    shm = _attached_buffers.get(name)
+    if shm is None:
+        shm = shared_memory.SharedMemory(name=name)
+        _attached_buffers[name] = shm
+    return np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+
+
+def _locate_shared_frames(backend, frames, min_face_size, regions):
+    return locate_faces(backend, [_shared_frame(name, shape) for name, shape in frames], min_face_size, regions)
+
+
+def _encode_shared_frames(backend, frames, locations):
+    return encode_faces(backend, [_shared_frame(name, shape) for name, shape in frames], locations)
+
+
+def _timed(function, *args):
+    # Runs function, also returning how long it took (the pool workers time themselves)
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def box_iou(boxes_a, boxes_b):
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(bottom - top, 0, None) * np.clip(right - left, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 1] - a[:, 3])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 1] - b[:, 3])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(union), where=union > 0)
+
+
+class FaceTracker:
+    # Links face boxes across analysed frames by IoU. A face on an existing
+    # track reuses the track's encoding; it is only encoded again when the
+    # track starts, when the match is uncertain, every refresh_interval frames
+    # or when a tiny grayscale crop of the face no longer looks like the one
+    # taken when the track was last encoded (someone else in the same spot).
+
+    def __init__(self, match_iou=0.3, stable_iou=0.6, refresh_interval=25, max_missed=2,
+                 appearance_threshold=12.0, appearance_size=(16, 16)):
+        self.match_iou = match_iou
+        self.stable_iou = stable_iou
+        self.refresh_interval = refresh_interval
+        self.max_missed = max_missed
+        self.appearance_threshold = appearance_threshold
+        self.appearance_size = appearance_size
+        self.tracks = []
+        self.step = 0
+        self.encoded = 0
+        self.reused = 0
+
+    def plan(self, face_locations, image):
+        # Returns one track per location and the locations that need an encoding
+        ious = box_iou([track['box'] for track in self.tracks], face_locations)
+        assigned = [None] * len(face_locations)
+        if ious.size:
+            for flat_index in np.argsort(ious, axis=None)[::-1]:
+                track_index, location_index = np.unravel_index(flat_index, ious.shape)
+                iou = ious[track_index, location_index]
+                if iou < self.match_iou:
+                    break
+                track = self.tracks[track_index]
+                if assigned[location_index] is None and track['step'] != self.step:
+                    track['step'] = self.step
+                    assigned[location_index] = (track, iou)
+
+        plan = []
+        to_encode = []
+        for location, match in zip(face_locations, assigned):
+            appearance = self.appearance(image, location)
+            if match is None:
+                track = {'box': location, 'step': self.step, 'encoded_step': self.step, 'encoding': None,
+                         'appearance': appearance}
+                self.tracks.append(track)
+                needs_encoding = True
+            else:
+                track, iou = match
+                track['box'] = location
+                needs_encoding = (iou < self.stable_iou or
+                                  self.step - track['encoded_step'] >= self.refresh_interval or
+                                  self.changed(track['appearance'], appearance))
+                if needs_encoding:
+                    track['encoded_step'] = self.step
+                    track['appearance'] = appearance
+            plan.append((track, needs_encoding))
+            if needs_encoding:
+                to_encode.append(location)
+
+        self.tracks = [track for track in self.tracks if self.step - track['step'] <= self.max_missed]
+        self.step += 1
+        return plan, to_encode
+
+    def appearance(self, image, location):
+        top, right, bottom, left = location
+        crop = image[max(top, 0):bottom, max(left, 0):right]
+        if crop.size == 0:
+            return None
+        gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+        return cv2.resize(gray, self.appearance_size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def changed(self, stored, appearance):
+        if stored is None or appearance is None:
+            return True
+        return float(np.abs(stored - appearance).mean()) > self.appearance_threshold
+
+    def reset(self):
+        # After a shot change no face can continue a track of the previous shot
+        self.tracks = []
+
+    def commit(self, plan, encodings):
+        # Must be called in the same frame order as plan()
+        encodings = iter(encodings)
+        results = []
+        for track, needs_encoding in plan:
+            if needs_encoding:
+                track['encoding'] = next(encodings)
+                self.encoded += 1
+            else:
+                self.reused += 1
+            results.append(track['encoding'])
+        return results
+
+
+def merge_regions(regions):
+    # Joins overlapping (top, right, bottom, left) rectangles into their bounding boxes
+    regions = [list(region) for region in regions]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                a, b = regions[i], regions[j]
+                if a[0] < b[2] and b[0] < a[2] and a[3] < b[1] and b[3] < a[1]:
+                    regions[i] = [min(a[0], b[0]), max(a[1], b[1]), max(a[2], b[2]), min(a[3], b[3])]
+                    del regions[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return [tuple(region) for region in regions]
+
+
+class RegionPlanner:
+    # ROI mode: faces are only searched for in padded regions around the faces
+    # found last. The full frame is scanned every full_scan_interval frames, when
+    # no face is known and as soon as a region search loses a face. Region results
+    # planned before the latest full scan finished are stale and do not replace its faces.
+
+    def __init__(self, full_scan_interval=10, margin=1.0, min_padding=40):
+        self.full_scan_interval = full_scan_interval
+        self.margin = margin
+        self.min_padding = min_padding
+        self.boxes = []
+        self.since_full_scan = None
+        self.generation = 0
+        self.full_scans = 0
+        self.region_scans = 0
+
+    def plan(self, shape):
+        # Returns (regions, expected faces, generation); regions is None for a full scan
+        height, width = shape[:2]
+        if not self.boxes or self.since_full_scan is None or self.since_full_scan >= self.full_scan_interval:
+            self.since_full_scan = 0
+            self.full_scans += 1
+            return None, 0, self.generation
+
+        self.since_full_scan += 1
+        self.region_scans += 1
+        regions = []
+        for top, right, bottom, left in self.boxes:
+            pad_y = max((bottom - top) * self.margin, self.min_padding)
+            pad_x = max((right - left) * self.margin, self.min_padding)
+            regions.append((max(0, int(top - pad_y)), min(width, int(right + pad_x)),
+                            min(height, int(bottom + pad_y)), max(0, int(left - pad_x))))
+        return merge_regions(regions), len(self.boxes), self.generation
+
+    def reset(self):
+        # After a shot change the next frame is scanned in full, and region
+        # results planned before it are dropped
+        self.boxes = []
+        self.since_full_scan = None
+        self.generation += 1
+
+    def update(self, scan, face_locations):
+        # Must be called in the same frame order as plan()
+        regions, expected, generation = scan
+        if regions is None:
+            self.generation += 1
+        elif generation != self.generation:
+            return
+        elif len(face_locations) < expected:
+            self.since_full_scan = None
+        self.boxes = list(face_locations)
+
+
+class MotionGate:
+    # Decides from a tiny grayscale copy of each sampled frame whether it needs
+    # a full face detection. Shot boundaries always do, and so do the next few
+    # samples after one; frames that barely differ from the last analysed frame
+    # inherit its faces, with a detection forced every max_skip samples.
+
+    def __init__(self, motion_threshold=3.0, scene_threshold=0.35, dense_samples=5, max_skip=15, size=(64, 36)):
+        self.motion_threshold = motion_threshold
+        self.scene_threshold = scene_threshold
+        self.dense_samples = dense_samples
+        self.max_skip = max_skip
+        self.size = size
+        self.reference = None
+        self.previous_histogram = None
+        self.dense_left = 0
+        self.skipped = 0
+        self.inherited = 0
+        self.scene_cuts = 0
+        self.scene_cut = False
+
+    def check(self, frame):
+        # Also sets scene_cut when the frame starts a new shot
+        tiny = cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        histogram = cv2.calcHist([tiny], [0], None, [32], [0, 256])
+        cv2.normalize(histogram, histogram)
+        self.scene_cut = (self.previous_histogram is not None and
+                          cv2.compareHist(self.previous_histogram, histogram, cv2.HISTCMP_BHATTACHARYYA) >
+                          self.scene_threshold)
+        self.previous_histogram = histogram
+
+        if self.scene_cut:
+            self.scene_cuts += 1
+            self.dense_left = self.dense_samples
+        elif self.dense_left:
+            self.dense_left -= 1
+        elif (self.reference is not None and self.skipped < self.max_skip and
+              cv2.absdiff(tiny, self.reference).mean() < self.motion_threshold):
+            self.skipped += 1
+            self.inherited += 1
+            return False
+
+        self.reference = tiny
+        self.skipped = 0
+        return True
+
+
+def _finished_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+class DetectionEngine:
+    # Runs face location and encoding in a process pool. Frames are grouped in
+    # batches of batch_size analysed frames, located with one backend call and
+    # encoded with one more. Downscaled frames are handed over through a bounded
+    # ring of shared-memory blocks instead of being pickled, and results are
+    # yielded in the order frames were submitted. Locations come back first so
+    # a tracker can decide which faces to encode. A frame passed without a
+    # downscaled copy inherits the previous frame's faces; a frame flagged as a
+    # scene cut starts with no tracks and a full-frame scan.
+
+    def __init__(self, workers=1, max_pending=None, min_face_size=0, profiler=None, backend=None, batch_size=1):
+        self.workers = max(1, workers)
+        self.min_face_size = min_face_size
+        self.profiler = profiler
+        self.backend = backend or HogBackend()
+        self.batch_size = max(1, batch_size)
+        self.max_pending = max_pending or self.workers * 2
+        self.executor = None
+        self.buffers = []
+        self.free_buffers = []
+        self.encoded = 0
+        self.last_result = ([], [])
+
+    def __enter__(self):
+        if self.workers > 1:
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        for shm in self.buffers:
+            shm.close()
+            shm.unlink()
+        self.buffers = []
+        self.free_buffers = []
+
+    def process(self, frames, tracker=None, regions=None):
+        if self.executor is None:
+            for batch in self._batches(frames):
+                analysed = [item for item in batch if item[2] is not None]
+                rgb_small_frames = [item[2] for item in analysed]
+                scene_cuts = [item[3] for item in analysed]
+                results = []
+                if rgb_small_frames:
+                    scans = [self._scan(regions, rgb_small_frame.shape, scene_cut)
+                             for rgb_small_frame, scene_cut in zip(rgb_small_frames, scene_cuts)]
+                    located = _timed(locate_faces, self.backend, rgb_small_frames, self.min_face_size,
+                                     [scan[0] for scan in scans])
+                    face_locations = self._located(located, regions, scans)
+                    plans, to_encode = self._plan(tracker, face_locations, rgb_small_frames, scene_cuts)
+                    encoded = _timed(encode_faces, self.backend, rgb_small_frames, to_encode)
+                    results = list(zip(face_locations, self._commit(tracker, plans, encoded)))
+                yield from self._results(batch, results)
+            return
+
+        located = deque()
+        encoding = deque()
+        for batch in self._batches(frames):
+            while len(located) + len(encoding) >= self.max_pending:
+                yield from self._advance(located, encoding, tracker, regions)
+
+            shared = []
+            scans = []
+            for _, _, rgb_small_frame, scene_cut in batch:
+                if rgb_small_frame is not None:
+                    shm = self._acquire_buffer(rgb_small_frame.nbytes)
+                    shared_frame = np.ndarray(rgb_small_frame.shape, dtype=np.uint8, buffer=shm.buf)
+                    shared_frame[:] = rgb_small_frame
+                    shared.append((shm, rgb_small_frame.shape))
+                    scans.append(self._scan(regions, rgb_small_frame.shape, scene_cut))
+
+            if shared:
+                future = self.executor.submit(_timed, _locate_shared_frames, self.backend,
+                                              [(shm.name, shape) for shm, shape in shared],
+                                              self.min_face_size, [scan[0] for scan in scans])
+            else:
+                future = _finished_future(None)
+            located.append((batch, shared, scans, future))
+
+        while located or encoding:
+            yield from self._advance(located, encoding, tracker, regions)
+
+    def _batches(self, frames):
+        # Inherited frames ride along with the analysed frames around them
+        batch = []
+        analysed = 0
+        for item in frames:
+            batch.append(item)
+            if item[2] is not None:
+                analysed += 1
+            if analysed == self.batch_size:
+                yield batch
+                batch = []
+                analysed = 0
+        if batch:
+            yield batch
+
+    def _results(self, batch, results):
+        results = iter(results)
+        for frame_index, frame_size, rgb_small_frame, _ in batch:
+            if rgb_small_frame is not None:
+                self.last_result = next(results)
+            yield (frame_index, frame_size) + self.last_result
+
+    def _advance(self, located, encoding, tracker, regions):
+        # Either moves the oldest located batch on to encoding, or finishes the oldest encoded one
+        if located and (not encoding or not encoding[0][-1].done()):
+            batch, shared, scans, future = located.popleft()
+            if not shared:
+                encoding.append((batch, shared, None, future))
+                return []
+
+            face_locations = self._located(future.result(), regions, scans)
+            images = [np.ndarray(shape, dtype=np.uint8, buffer=shm.buf) for shm, shape in shared]
+            scene_cuts = [item[3] for item in batch if item[2] is not None]
+            plans, to_encode = self._plan(tracker, face_locations, images, scene_cuts)
+            if any(to_encode):
+                future = self.executor.submit(_timed, _encode_shared_frames, self.backend,
+                                              [(shm.name, shape) for shm, shape in shared], to_encode)
+            else:
+                future = _finished_future(([[] for _ in to_encode], 0.0))
+            encoding.append((batch, shared, (face_locations, plans), future))
+            return []
+
+        batch, shared, planned, future = encoding.popleft()
+        results = []
+        if shared:
+            face_locations, plans = planned
+            results = list(zip(face_locations, self._commit(tracker, plans, future.result())))
+            self.free_buffers.extend(shm for shm, _ in shared)
+        return list(self._results(batch, results))
+
+    def _scan(self, regions, shape, scene_cut=False):
+        if regions is None:
+            return None, 0, 0
+        if scene_cut:
+            regions.reset()
+        return regions.plan(shape)
+
+    def _located(self, located, regions, scans):
+        face_locations, seconds = located
+        if self.profiler is not None:
+            self.profiler.add('face_locations', seconds)
+            self.profiler.count('frames_analysed', len(face_locations))
+            self.profiler.count('faces_found', sum(len(locations) for locations in face_locations))
+        if regions is not None:
+            for scan, locations in zip(scans, face_locations):
+                regions.update(scan, locations)
+        return face_locations
+
+    def _plan(self, tracker, face_locations, images, scene_cuts):
+        if tracker is None:
+            return [None] * len(face_locations), face_locations
+        plans = []
+        to_encode = []
+        for locations, image, scene_cut in zip(face_locations, images, scene_cuts):
+            if scene_cut:
+                tracker.reset()
+            plan, needed = tracker.plan(locations, image)
+            plans.append(plan)
+            to_encode.append(needed)
+        return plans, to_encode
+
+    def _commit(self, tracker, plans, encoded):
+        encodings, seconds = encoded
+        computed = sum(len(frame_encodings) for frame_encodings in encodings)
+        if self.profiler is not None and computed:
+            self.profiler.add('face_encodings', seconds)
+            self.profiler.count('encodings_computed', computed)
+        if tracker is None:
+            self.encoded += computed
+            return [list(frame_encodings) for frame_encodings in encodings]
+        return [tracker.commit(plan, frame_encodings) for plan, frame_encodings in zip(plans, encodings)]
+
+    def _acquire_buffer(self, nbytes):
+        while self.free_buffers:
+            shm = self.free_buffers.pop()
+            if shm.size >= nbytes:
+                return shm
+            self.buffers.remove(shm)
+            shm.close()
+            shm.unlink()
+
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.buffers.append(shm)
+        return shm
+
+
+def pairwise_distances(a, b):
+    squared = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2.0 * (a @ b.T)
+    return np.sqrt(np.maximum(squared, 0.0))
+
+
+def connected_components(size, pairs):
+    parent = list(range(size))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in np.asarray(pairs, dtype=np.int64).reshape(-1, 2).tolist():
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    roots = np.array([find(i) for i in range(size)], dtype=np.int64)
+    _, labels = np.unique(roots, return_inverse=True)
+    return labels
+
+
+# Distances computed at once when merging people (a block of rows times all people)
+MERGE_BLOCK_ELEMENTS = 1 << 22
+
+
+class IdentityClusterer:
+    # Keeps one running-mean centroid per person in a contiguous matrix and
+    # assigns each batch of encodings with a single distance computation.
+
+    def __init__(self, tolerance, dimensions=128, capacity=64):
+        self.tolerance = tolerance
+        self.centroids = np.zeros((capacity, dimensions))
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.size = 0
+
+    def assign(self, encodings):
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, self.centroids.shape[1])
+        labels = np.full(len(encodings), -1, dtype=np.int64)
+        if len(encodings) == 0:
+            return labels
+
+        existing = self.size
+        if existing:
+            distances = pairwise_distances(encodings, self.centroids[:existing])
+            nearest = distances.argmin(axis=1)
+            matched = distances[np.arange(len(encodings)), nearest] <= self.tolerance
+            labels[matched] = nearest[matched]
+
+        # Faces that matched nobody may still match a person created earlier in this batch
+        for i in np.flatnonzero(labels < 0):
+            if self.size > existing:
+                distances = np.linalg.norm(self.centroids[existing:self.size] - encodings[i], axis=1)
+                nearest = int(distances.argmin())
+                if distances[nearest] <= self.tolerance:
+                    labels[i] = existing + nearest
+                    self._update(labels[i:i + 1], encodings[i:i + 1])
+                    continue
+            labels[i] = self._add(encodings[i])
+
+        matched = (labels >= 0) & (labels < existing)
+        if matched.any():
+            self._update(labels[matched], encodings[matched])
+        return labels
+
+    def merge(self, tolerance=None, block_size=None):
+        # Distances are computed a block of rows at a time and only the pairs
+        # within tolerance are kept, so thousands of people never need a full matrix
+        tolerance = self.tolerance if tolerance is None else tolerance
+        centroids = self.centroids[:self.size]
+        block_size = block_size or max(1, MERGE_BLOCK_ELEMENTS // max(self.size, 1))
+        squared_norms = (centroids * centroids).sum(axis=1)
+        pairs = [np.empty((0, 2), dtype=np.int64)]
+        for start in range(0, self.size, block_size):
+            # Squared distances of this block to itself and every later person
+            block = centroids[start:start + block_size]
+            squared = (squared_norms[start:start + len(block), None] + squared_norms[None, start:] -
+                       2.0 * (block @ centroids[start:].T))
+            rows, columns = np.nonzero(squared <= tolerance * tolerance)
+            upper = columns > rows
+            pairs.append(np.stack([rows[upper] + start, columns[upper] + start], axis=1))
+        mapping = connected_components(self.size, np.concatenate(pairs))
+
+        merged_size = int(mapping.max()) + 1 if self.size else 0
+        counts = np.bincount(mapping, weights=self.counts[:self.size], minlength=merged_size)
+        sums = np.zeros((merged_size, centroids.shape[1]))
+        np.add.at(sums, mapping, centroids * self.counts[:self.size, None])
+
+        self.centroids[:merged_size] = sums / counts[:, None]
+        self.counts[:merged_size] = counts.astype(np.int64)
+        self.counts[merged_size:self.size] = 0
+        self.size = merged_size
+        return mapping
+
+    def restore(self, centroids, counts):
+        # Continues from centroids and counts saved by an earlier, interrupted pass
+        size = len(centroids)
+        capacity = max(size, len(self.centroids))
+        self.centroids = np.zeros((capacity, self.centroids.shape[1]))
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.centroids[:size] = centroids
+        self.counts[:size] = counts
+        self.size = size
+
+    def _add(self, encoding):
+        if self.size == len(self.centroids):
+            self.centroids = np.concatenate([self.centroids, np.zeros_like(self.centroids)])
+            self.counts = np.concatenate([self.counts, np.zeros_like(self.counts)])
+        self.centroids[self.size] = encoding
+        self.counts[self.size] = 1
+        self.size += 1
+        return self.size - 1
+
+    def _update(self, labels, encodings):
+        sums = np.zeros((self.size, encodings.shape[1]))
+        np.add.at(sums, labels, encodings)
+        added = np.bincount(labels, minlength=self.size)
+        touched = added > 0
+        counts = self.counts[:self.size][touched]
+        self.centroids[:self.size][touched] = (
+            self.centroids[:self.size][touched] * counts[:, None] + sums[touched]
+        ) / (counts + added[touched])[:, None]
+        self.counts[:self.size][touched] += added[touched]
+
+
+def cluster_by_frame(clusterer, frame_indices, encodings):
+    # Replays the clustering of a detection pass, one assign() per frame in
+    # frame order, so the labels equal those of a live pass
+    encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, clusterer.centroids.shape[1])
+    if len(encodings) == 0:
+        return np.empty(0, dtype=np.int64)
+    bounds = np.flatnonzero(np.diff(frame_indices)) + 1
+    return np.concatenate([clusterer.assign(frame_encodings) for frame_encodings in np.split(encodings, bounds)])
+
+
+class Regrouper:
+    # Regroups the detections of a finished pass at another tolerance exactly
+    # as a new detection pass would, without decoding the video again. Each
+    # tolerance is only clustered once.
+
+    def __init__(self, frame_indices, encodings, merge_clusters=True):
+        self.frame_indices = np.asarray(frame_indices)
+        self.encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+        self.merge_clusters = merge_clusters
+        self.cuts = {}
+
+    def ready(self, tolerance):
+        return round(tolerance, 3) in self.cuts
+
+    def cut(self, tolerance):
+        # Label of every detection and the centroid of every label
+        key = round(tolerance, 3)
+        if key not in self.cuts:
+            clusterer = IdentityClusterer(tolerance)
+            labels = cluster_by_frame(clusterer, self.frame_indices, self.encodings)
+            if self.merge_clusters and len(labels):
+                labels = clusterer.merge()[labels]
+            self.cuts[key] = (labels, clusterer.centroids[:clusterer.size].copy())
+        return self.cuts[key]
+
+    def people(self, tolerance):
+        labels, centroids = self.cut(tolerance)
+        groups = [[] for _ in range(len(centroids))]
+        for index, label in enumerate(labels.tolist()):
+            groups[label].append(index)
+        return [{'encoding': centroids[label].copy(), 'face_index': indices[0], 'indices': indices}
+                for label, indices in enumerate(groups) if indices]
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "face_based_video_cutter")
+DEFAULT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+CACHE_VERSION = 1
+# Bytes hashed from the start and the end of the video to fingerprint its content
+CACHE_HASH_CHUNK = 4 * 1024 * 1024
+
+
+class EncodingCache:
+    # Stores the detections of a pass (frame index, bbox, 128-d encoding) as
+    # one .npz file per video and sampling setup. Files are evicted least
+    # recently used first once the directory grows past max_bytes.
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def key(self, video_path, settings):
+        # settings is a tuple of every detection option that changes the stored results
+        stat = os.stat(video_path)
+        digest = hashlib.sha1()
+        with open(video_path, "rb") as f:
+            digest.update(f.read(CACHE_HASH_CHUNK))
+            if stat.st_size > CACHE_HASH_CHUNK:
+                f.seek(max(CACHE_HASH_CHUNK, stat.st_size - CACHE_HASH_CHUNK))
+                digest.update(f.read(CACHE_HASH_CHUNK))
+        digest.update(repr((CACHE_VERSION, stat.st_size, stat.st_mtime_ns) + tuple(settings)).encode())
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def load(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                entry = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return entry
+
+    def store(self, key, frame_indices, boxes, encodings):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key)
+        temp_path = path + ".tmp.npz"
+        np.savez(
+            temp_path,
+            frame_indices=np.asarray(frame_indices, dtype=np.int64),
+            boxes=np.asarray(boxes, dtype=np.int32).reshape(-1, 4),
+            encodings=np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        )
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".npz", ".journal")):
+                stat = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+
+# One journal row per face; the label is the clusterer's, before merging
+JOURNAL_DTYPE = np.dtype([('frame', '<i8'), ('label', '<i4'), ('box', '<i4', (4,)), ('encoding', '<f4', (128,))])
+# Seconds between two checkpoints of a running pass
+CHECKPOINT_INTERVAL = 30.0
+
+
+class DetectionJournal:
+    # Append-only store of an unfinished pass, kept next to the cache: fixed-size
+    # rows in <key>.journal plus the last checkpoint (last processed frame, rows
+    # written by then and clusterer state). Rows past the checkpoint are dropped on resume.
+
+    def __init__(self, cache_dir, key):
+        self.cache_dir = cache_dir
+        self.path = os.path.join(cache_dir, f"{key}.journal")
+        self.checkpoint_path = os.path.join(cache_dir, f"{key}.checkpoint.npz")
+        self.file = None
+        self.rows = 0
+
+    def load(self):
+        # Returns (rows, checkpoint) of an interrupted pass, or None
+        if not os.path.exists(self.path) or not os.path.exists(self.checkpoint_path):
+            return None
+        try:
+            with np.load(self.checkpoint_path) as data:
+                checkpoint = {name: data[name] for name in data.files}
+            rows = np.fromfile(self.path, dtype=JOURNAL_DTYPE, count=int(checkpoint['rows']))
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(rows) < int(checkpoint['rows']):
+            return None
+        return rows, checkpoint
+
+    def open(self, rows=0):
+        # Starts writing after the first `rows` rows, discarding anything later
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.file = open(self.path, "r+b" if rows and os.path.exists(self.path) else "wb")
+        self.file.truncate(rows * JOURNAL_DTYPE.itemsize)
+        self.file.seek(0, os.SEEK_END)
+        self.rows = rows
+
+    def append(self, frame_indices, labels, boxes, encodings):
+        rows = np.empty(len(frame_indices), dtype=JOURNAL_DTYPE)
+        rows['frame'] = frame_indices
+        rows['label'] = labels
+        rows['box'] = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        rows['encoding'] = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        self.file.write(rows.tobytes())
+        self.rows += len(rows)
+
+    def checkpoint(self, last_frame, clusterer):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        temp_path = self.checkpoint_path + ".tmp.npz"
+        np.savez(temp_path, rows=self.rows, last_frame=last_frame,
+                 centroids=clusterer.centroids[:clusterer.size], counts=clusterer.counts[:clusterer.size])
+        os.replace(temp_path, self.checkpoint_path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def discard(self):
+        self.close()
+        for path in (self.path, self.checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class DetectionTable:
+    # One row per detected face: frame index, bbox (top, right, bottom, left)
+    # in source-frame pixels and the encoding, kept in growable arrays.
+
+    def __init__(self, capacity=1024):
+        self._frame_indices = np.empty(capacity, dtype=np.int64)
+        self._boxes = np.empty((capacity, 4), dtype=np.int32)
+        self._encodings = np.empty((capacity, 128), dtype=np.float32)
+        self.size = 0
+
+    @classmethod
+    def from_arrays(cls, frame_indices, boxes, encodings):
+        table = cls(max(len(frame_indices), 1))
+        table.append(frame_indices, boxes, encodings)
+        return table
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def frame_indices(self):
+        return self._frame_indices[:self.size]
+
+    @property
+    def boxes(self):
+        return self._boxes[:self.size]
+
+    @property
+    def encodings(self):
+        return self._encodings[:self.size]
+
+    def append(self, frame_indices, boxes, encodings):
+        count = len(frame_indices)
+        if self.size + count > len(self._frame_indices):
+            capacity = max(self.size + count, 2 * len(self._frame_indices))
+            self._frame_indices = np.resize(self._frame_indices, capacity)
+            self._boxes = np.resize(self._boxes, (capacity, 4))
+            self._encodings = np.resize(self._encodings, (capacity, 128))
+
+        end = self.size + count
+        self._frame_indices[self.size:end] = frame_indices
+        self._boxes[self.size:end] = np.asarray(boxes, dtype=np.int32).reshape(-1, 4)
+        self._encodings[self.size:end] = np.asarray(encodings, dtype=np.float32).reshape(-1, 128)
+        self.size = end
+
+
+THUMBNAIL_SIZE = 150
+
+
+def make_thumbnail(frame, box):
+    top, right, bottom, left = box
+    face_img = frame[top:bottom, left:right]
+    if face_img.size == 0:
+        return None
+    scale = THUMBNAIL_SIZE / max(face_img.shape[:2])
+    if scale < 1:
+        face_img = cv2.resize(face_img, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return face_img.copy()
+
+
+def load_thumbnails(video_path, detections, indices):
+    # Decodes only the frames holding the requested faces, in file order
+    thumbnails = {}
+    if not indices:
+        return thumbnails
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return thumbnails
+
+    position = 0
+    frame = None
+    for index in sorted(set(indices), key=lambda i: detections.frame_indices[i]):
+        frame_index = int(detections.frame_indices[index])
+        if frame is None or frame_index != position - 1:
+            position = advance_to(cap, position, frame_index)
+            ret, frame = cap.read()
+            if not ret:
+                break
+            position += 1
+        thumbnails[index] = make_thumbnail(frame, detections.boxes[index])
+
+    cap.release()
+    return thumbnails
+
+
+class ThumbnailCache:
+    def __init__(self, capacity=512):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def __contains__(self, index):
+        return index in self.entries
+
+    def get(self, index):
+        thumbnail = self.entries.get(index)
+        if index in self.entries:
+            self.entries.move_to_end(index)
+        return thumbnail
+
+    def update(self, thumbnails):
+        for index, thumbnail in thumbnails.items():
+            self.entries[index] = thumbnail
+            self.entries.move_to_end(index)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class ReferenceGallery:
+    # Encodings of the person we are looking for, taken from reference photos
+    # or from a saved .npy encoding file
+
+    def __init__(self, encodings):
+        self.encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+
+    @classmethod
+    def from_files(cls, paths):
+        encodings = []
+        for path in paths:
+            if os.path.splitext(path)[1].lower() == ".npy":
+                encodings.extend(np.load(path).reshape(-1, 128))
+                continue
+
+            image = face_recognition.load_image_file(path)
+            face_locations = face_recognition.face_locations(image)
+            if face_locations:
+                largest = max(face_locations, key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
+                encodings.extend(face_recognition.face_encodings(image, [largest]))
+
+        if not encodings:
+            raise ValueError("No face found in the reference files.")
+        return cls(encodings)
+
+    def assign(self, encodings, tolerance):
+        # Label 0 for faces matching the gallery, -1 for everyone else
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+        if len(encodings) == 0:
+            return np.empty(0, dtype=np.int64)
+        distances = pairwise_distances(encodings, self.encodings).min(axis=1)
+        return np.where(distances <= tolerance, 0, -1)
+
+
+DEFAULT_PERSON_INDEX_DIR = os.path.join(DEFAULT_CACHE_DIR, "people")
+
+
+class PersonIndex:
+    # Identities shared by every indexed video: one float32 centroid per person
+    # in centroids.npy (memory-mapped for lookups), the number of videos that
+    # centroid was averaged over in counts.npy, and the videos each person was
+    # found in. Person IDs never change once given out.
+
+    def __init__(self, index_dir=DEFAULT_PERSON_INDEX_DIR):
+        self.index_dir = index_dir
+        self.centroids_path = os.path.join(index_dir, "centroids.npy")
+        self.counts_path = os.path.join(index_dir, "counts.npy")
+        self.videos_path = os.path.join(index_dir, "videos.json")
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        # An index that cannot be read (a truncated file, say) starts over empty
+        self.centroids = np.empty((0, 128), dtype=np.float32)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.videos = {}
+        try:
+            if os.path.exists(self.centroids_path) and os.path.exists(self.counts_path):
+                centroids = np.load(self.centroids_path, mmap_mode="r")
+                counts = np.load(self.counts_path)
+                if centroids.shape != (len(counts), 128):
+                    return
+                self.centroids, self.counts = centroids, counts
+            if os.path.exists(self.videos_path):
+                with open(self.videos_path) as f:
+                    self.videos = json.load(f)
+        except (OSError, ValueError):
+            self.centroids = np.empty((0, 128), dtype=np.float32)
+            self.counts = np.empty(0, dtype=np.int64)
+            self.videos = {}
+
+    def __len__(self):
+        return len(self.centroids)
+
+    def lookup(self, encodings, tolerance):
+        # Index person ID of each encoding (the people of one video), -1 where
+        # nobody is close enough. Closest pairs are matched first and every ID
+        # goes to one encoding at most, so two people never share an ID.
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+        ids = np.full(len(encodings), -1, dtype=np.int64)
+        if len(encodings) == 0 or len(self.centroids) == 0:
+            return ids
+        distances = pairwise_distances(encodings, np.asarray(self.centroids, dtype=np.float64))
+        people, person_ids = np.nonzero(distances <= tolerance)
+        order = np.argsort(distances[people, person_ids], kind="stable")
+        taken = set()
+        for person, person_id in zip(people[order].tolist(), person_ids[order].tolist()):
+            if ids[person] < 0 and person_id not in taken:
+                ids[person] = person_id
+                taken.add(person_id)
+        return ids
+
+    def register(self, video_path, encodings, tolerance):
+        # Maps the people of one video (one encoding each) to index IDs, adding
+        # the ones never seen before. A video only moves a centroid once.
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, 128)
+        video_path = os.path.abspath(video_path)
+        with self.lock:
+            ids = self.lookup(encodings, tolerance)
+            centroids = np.array(self.centroids, dtype=np.float64)
+            counts = self.counts.copy()
+            known = set(self.videos.get(video_path, []))
+
+            new = np.flatnonzero(ids < 0)
+            ids[new] = len(centroids) + np.arange(len(new))
+            centroids = np.concatenate([centroids, encodings[new]])
+            counts = np.concatenate([counts, np.zeros(len(new), dtype=np.int64)])
+            for person_id, encoding in zip(ids.tolist(), encodings):
+                if person_id not in known:
+                    centroids[person_id] = (centroids[person_id] * counts[person_id] + encoding) / (counts[person_id] + 1)
+                    counts[person_id] += 1
+                    known.add(person_id)
+
+            self.videos[video_path] = sorted(known)
+            self.save(centroids, counts)
+        return ids
+
+    def save(self, centroids, counts):
+        os.makedirs(self.index_dir, exist_ok=True)
+        arrays = ((self.centroids_path, centroids.astype(np.float32)), (self.counts_path, counts))
+        for path, array in arrays:
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+        with open(self.videos_path + ".tmp", "w") as f:
+            json.dump(self.videos, f, indent=1)
+
+        # Drops the memory map first, Windows cannot replace a file that is still mapped
+        self.centroids = np.empty((0, 128), dtype=np.float32)
+        for path, _ in arrays:
+            os.replace(path + ".tmp", path)
+        os.replace(self.videos_path + ".tmp", self.videos_path)
+        self.centroids = np.load(self.centroids_path, mmap_mode="r")
+        self.counts = counts
+
+    def videos_with(self, person_ids):
+        person_ids = set(person_ids)
+        return [video for video, ids in sorted(self.videos.items()) if person_ids.intersection(ids)]
+
+    def gallery(self, person_ids):
+        return ReferenceGallery(np.asarray(self.centroids[sorted(person_ids)], dtype=np.float64))
+
+
+def peak_rss_mb(children=False):
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return round(usage / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def current_rss_mb():
+    # Resident memory right now where /proc exists, otherwise the peak so far
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+class Profiler:
+    # Optional instrumentation shared by the detection and export threads: wall
+    # time per stage, counters and memory high-water marks per phase. Hooks take
+    # profiler=None when profiling is off, which costs one None check each.
+
+    def __init__(self, memory_interval=0.1):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+        self.peak_memory = {}
+        self.memory_interval = memory_interval
+        self.last_memory_sample = None
+        self.started = time.perf_counter()
+
+    def add(self, stage, seconds, calls=1):
+        with self.lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def timed(self, items, stage):
+        # Yields the items, adding the time spent producing each one to stage
+        iterator = iter(items)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, time.perf_counter() - started)
+            yield item
+
+    def sample_memory(self, phase):
+        now = time.perf_counter()
+        if self.last_memory_sample is not None and now - self.last_memory_sample < self.memory_interval:
+            return
+        self.last_memory_sample = now
+        rss = current_rss_mb()
+        if rss is not None:
+            with self.lock:
+                self.peak_memory[phase] = max(self.peak_memory.get(phase, 0.0), rss)
+
+    def summary(self):
+        with self.lock:
+            stages = {
+                name: {
+                    'calls': calls,
+                    'total_seconds': round(total, 4),
+                    'mean_ms': round(total * 1000 / calls, 3) if calls else 0.0,
+                    'max_ms': round(longest * 1000, 3)
+                }
+                for name, (calls, total, longest) in self.stages.items()
+            }
+            memory = dict(self.peak_memory)
+            counters = dict(self.counters)
+        memory['process_peak'] = peak_rss_mb()
+        memory['workers_peak'] = peak_rss_mb(children=True)
+        return {
+            'elapsed_seconds': round(time.perf_counter() - self.started, 3),
+            'stages': stages,
+            'counters': counters,
+            'memory_mb': memory
+        }
+
+    def write(self, path):
+        # A .csv path gets one row per stage, counter and memory mark; anything else gets JSON
+        summary = self.summary()
+        if os.path.splitext(path)[1].lower() != ".csv":
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2)
+            return
+
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["kind", "name", "calls", "total_seconds", "mean_ms", "max_ms", "value"])
+            for name, stage in summary['stages'].items():
+                writer.writerow(["stage", name, stage['calls'], stage['total_seconds'],
+                                 stage['mean_ms'], stage['max_ms'], ""])
+            for name, value in summary['counters'].items():
+                writer.writerow(["counter", name, "", "", "", "", value])
+            for name, value in summary['memory_mb'].items():
+                writer.writerow(["memory_mb", name, "", "", "", "", value])
+
+
+def format_profile(summary):
+    lines = [f"{name}: {stage['calls']} calls, {stage['total_seconds']:.2f} s total, "
+             f"{stage['mean_ms']:.2f} ms avg, {stage['max_ms']:.2f} ms max"
+             for name, stage in sorted(summary['stages'].items(), key=lambda item: -item[1]['total_seconds'])]
+    lines.extend(f"{name}: {value}" for name, value in summary['counters'].items())
+    lines.extend(f"Peak memory ({name}): {value} MB" for name, value in summary['memory_mb'].items()
+                 if value is not None)
+    return "\n".join(lines)
+
+
+class ProgressReporter:
+    # Coalesces (done, total) updates from a worker into at most one snapshot per
+    # interval, carrying the overall rate, an ETA and the rate of each named stage
+
+    def __init__(self, callback, interval=PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = None
+
+    def update(self, done, total, stages=None):
+        now = time.monotonic()
+        finished = total > 0 and done >= total
+        if not finished and self.last_report is not None and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+
+        elapsed = max(now - self.started, 1e-6)
+        rate = done / elapsed
+        self.callback({
+            'done': done,
+            'total': total,
+            'percent': min(100, int(done * 100 / total)) if total > 0 else 0,
+            'rate': rate,
+            'eta': (total - done) / rate if rate > 0 and total > done else 0.0,
+            'stages': {name: count / elapsed for name, count in (stages or {}).items()}
+        })
+
+
+def format_progress(snapshot):
+    text = f"{snapshot['percent']}% | {snapshot['rate']:.1f} frames/s"
+    if snapshot['eta']:
+        minutes, seconds = divmod(int(round(snapshot['eta'])), 60)
+        text += f" | ETA {minutes}:{seconds:02d}"
+    if snapshot['stages']:
+        text += " | " + ", ".join(f"{name} {rate:.1f}/s" for name, rate in snapshot['stages'].items())
+    return text
+
+
+class FaceDetector:
+    def __init__(self, video_path, face_tolerance=0.7, sample_interval=1, analyses_per_second=None, workers=1,
+                 merge_clusters=True, downscale=None, cache=None, progress_callback=None,
+                 reference=None, min_face_size=0, tracking=True, track_refresh=25, motion_gating=True,
+                 pixel_budget=DEFAULT_PIXEL_BUDGET, target_face_size=None, roi_detection=False,
+                 full_scan_interval=10, profiler=None, backend=None, batch_size=4):
         self.video_path = video_path
         self.face_tolerance = face_tolerance
         self.sample_interval = sample_interval
+        self.analyses_per_second = analyses_per_second
+        self.workers = workers
+        self.merge_clusters = merge_clusters
+        self.downscale = downscale
+        self.cache = cache
+        self.progress_callback = progress_callback
+        self.reference = reference
+        self.min_face_size = min_face_size
+        self.tracking = tracking
+        self.track_refresh = track_refresh
+        self.motion_gating = motion_gating
+        self.pixel_budget = pixel_budget
+        self.target_face_size = target_face_size
+        self.roi_detection = roi_detection
+        self.full_scan_interval = full_scan_interval
+        self.profiler = profiler
+        self.backend = backend or HogBackend()
+        self.batch_size = batch_size
+        self.scale = downscale
+        self.stage_counts = {}
         self.running = True
         
     def run(self):
         cap = cv2.VideoCapture(self.video_path)
         if not cap.isOpened():
-            return
+            return None
             
         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        all_faces = []
-        face_encodings = []
-        face_frames = []
+        self.scale = self.downscale or detection_scale(int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                                                       int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                                                       self.pixel_budget, self.target_face_size)
+        detections = DetectionTable()
         unique_faces = []
+        clusterer = IdentityClusterer(self.face_tolerance)
+        self.stage_counts = {'decode': 0, 'detect': 0, 'cluster': 0}
+
+        cache_key = None
+        cached = None
+        if self.cache is not None:
+            cache_key = self.cache.key(self.video_path, (
+                self.sample_interval, self.analyses_per_second, round(self.scale, 6),
+                self.track_refresh if self.tracking else None, self.motion_gating,
+                self.full_scan_interval if self.roi_detection else None, self.backend.name
+            ))
+            started = time.perf_counter()
+            cached = self.cache.load(cache_key)
+            self.record('cache', started)
+
+        stats = {'cached': cached is not None, 'frames_sampled': 0, 'frames_analysed': 0, 'frames_inherited': 0,
+                 'scene_cuts': 0, 'encodings_computed': 0, 'encodings_reused': 0, 'region_scans': 0,
+                 'resumed_from': 0, 'partial': False, 'last_frame': total_frames - 1}
+        journal = None
+        if cached is not None:
+            detections = self.cached_table(cached)
+            self.cluster_cached(detections, unique_faces, clusterer)
+        elif cache_key is not None:
+            # Unfinished passes are journaled next to the cache and resumed from their checkpoint
+            journal = DetectionJournal(self.cache.cache_dir, self.journal_key(cache_key))
+            resumed = journal.load()
+            if resumed is not None:
+                rows, checkpoint = resumed
+                detections = DetectionTable.from_arrays(rows['frame'], rows['box'], rows['encoding'])
+                clusterer.restore(checkpoint['centroids'], checkpoint['counts'])
+                for index, label in enumerate(rows['label']):
+                    while label >= len(unique_faces):
+                        unique_faces.append({'indices': []})
+                    unique_faces[label]['indices'].append(index)
+                stats['resumed_from'] = int(checkpoint['last_frame']) + 1
+            journal.open(len(detections))
+
+        if cached is None:
+            min_face_size = int(self.min_face_size * self.scale)
+            tracker = FaceTracker(refresh_interval=self.track_refresh) if self.tracking else None
+            gate = MotionGate() if self.motion_gating else None
+            regions = RegionPlanner(self.full_scan_interval) if self.roi_detection else None
+            with DetectionEngine(self.workers, min_face_size=min_face_size, profiler=self.profiler,
+                                 backend=self.backend, batch_size=self.batch_size) as engine:
+                # Decoding, detection and clustering each run on their own thread
+                frames = threaded_stage(self.counted(self.prepared_frames(cap, gate, stats['resumed_from']), 'decode'))
+                results = threaded_stage(self.counted(engine.process(frames, tracker, regions), 'detect'))
+                last_checkpoint = time.monotonic()
+                last_frame = stats['resumed_from'] - 1
+                try:
+                    for frame_count, frame_size, face_locations, encodings in results:
+                        started = time.perf_counter()
+                        first_row = len(detections)
+                        labels = self.collect_faces(frame_count, frame_size, face_locations, encodings,
+                                                    detections, unique_faces, clusterer)
+                        self.record('cluster', started)
+                        last_frame = frame_count
+                        stats['frames_sampled'] += 1
+                        self.stage_counts['cluster'] += 1
+                        self.report_progress(frame_count + 1, total_frames)
+
+                        if journal is not None:
+                            journal.append(detections.frame_indices[first_row:], labels,
+                                           detections.boxes[first_row:], detections.encodings[first_row:])
+                            if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                                journal.checkpoint(last_frame, clusterer)
+                                last_checkpoint = time.monotonic()
+                finally:
+                    # Also reached on cancel, Ctrl+C or errors, so the next run can resume
+                    if journal is not None:
+                        journal.checkpoint(last_frame, clusterer)
+                        journal.close()
+
+            if not self.running:
+                stats['partial'] = True
+                stats['last_frame'] = last_frame
+
+            if gate is not None:
+                stats['frames_inherited'] = gate.inherited
+                stats['scene_cuts'] = gate.scene_cuts
+            stats['frames_analysed'] = stats['frames_sampled'] - stats['frames_inherited']
+            if regions is not None:
+                stats['region_scans'] = regions.region_scans
+
+            if tracker is not None:
+                stats['encodings_computed'] = tracker.encoded
+                stats['encodings_reused'] = tracker.reused
+            else:
+                stats['encodings_computed'] = engine.encoded
+
+            # Only complete passes are cached; filtered ones are derived from them on load
+            if self.running and cache_key is not None and self.reference is None and not self.min_face_size:
+                started = time.perf_counter()
+                self.cache.store(cache_key, detections.frame_indices, detections.boxes, detections.encodings)
+                self.record('cache', started)
+            if self.running and journal is not None:
+                journal.discard()
+            
+        cap.release()
         
-        frame_count = 0
-        processed_frames = 0
-        while cap.isOpened() and self.running:
+        # A stopped pass still returns what it found so far, flagged as partial
+        if self.running or stats['partial']:
+            started = time.perf_counter()
+            unique_faces = self.finish_clusters(unique_faces, clusterer)
+            self.record('merge', started)
+
+            started = time.perf_counter()
+            thumbnails = load_thumbnails(self.video_path, detections,
+                                         [person['face_index'] for person in unique_faces])
+            self.record('thumbnails', started)
+            return {
+                'detections': detections,
+                'unique_faces': unique_faces,
+                'total_frames': total_frames,
+                'thumbnails': thumbnails,
+                'stats': stats
+            }
+        return None
+
+    def report_progress(self, done, total):
+        started = time.perf_counter()
+        if self.progress_callback:
+            self.progress_callback(done, total, {stage: count for stage, count in self.stage_counts.items() if count})
+        if self.profiler is not None:
+            self.profiler.add('progress', time.perf_counter() - started)
+            self.profiler.sample_memory('detection')
+
+    def journal_key(self, cache_key):
+        # Journal rows carry cluster labels, so they also depend on the clustering settings
+        reference = hashlib.sha1(self.reference.encodings.tobytes()).hexdigest() if self.reference is not None else None
+        return hashlib.sha1(repr((cache_key, self.face_tolerance, self.min_face_size,
+                                  reference)).encode()).hexdigest()
+
+    def record(self, stage, started):
+        if self.profiler is not None:
+            self.profiler.add(stage, time.perf_counter() - started)
+
+    def counted(self, items, stage):
+        for item in items:
+            self.stage_counts[stage] += 1
+            yield item
+
+    def cached_table(self, cached):
+        frame_indices, boxes, encodings = cached['frame_indices'], cached['boxes'], cached['encodings']
+        if self.min_face_size:
+            heights = boxes[:, 2] - boxes[:, 0]
+            widths = boxes[:, 1] - boxes[:, 3]
+            kept = (heights >= self.min_face_size) & (widths >= self.min_face_size)
+            frame_indices, boxes, encodings = frame_indices[kept], boxes[kept], encodings[kept]
+        if self.reference is not None:
+            kept = self.reference.assign(encodings, self.face_tolerance) >= 0
+            frame_indices, boxes, encodings = frame_indices[kept], boxes[kept], encodings[kept]
+        return DetectionTable.from_arrays(frame_indices, boxes, encodings)
+
+    def assign_labels(self, encodings, clusterer):
+        if self.reference is not None:
+            return self.reference.assign(encodings, self.face_tolerance)
+        return clusterer.assign(encodings)
+
+    def cluster_cached(self, detections, unique_faces, clusterer):
+        if self.reference is not None:
+            labels = np.zeros(len(detections), dtype=np.int64)
+        else:
+            labels = cluster_by_frame(clusterer, detections.frame_indices, detections.encodings)
+        for index, label in enumerate(labels):
+            if label >= len(unique_faces):
+                unique_faces.append({'indices': [index]})
+            else:
+                unique_faces[label]['indices'].append(index)
+        self.report_progress(len(detections), len(detections))
+
+    def prepared_frames(self, cap, gate=None, start_frame=0):
+        # Downscaled frames cycle through a ring of preallocated buffers. A buffer is only
+        # rewritten after the queue and the batch behind it have drained, so the ring outlives both.
+        # Only the frame size and the scene-cut flag travel on; full-resolution frames are dropped here.
+        ring = []
+        ring_size = PIPELINE_QUEUE_SIZE + 3 + self.batch_size
+        prepared = 0
+        frames = iter_sampled_frames(cap, self.sample_interval, self.analyses_per_second, start_frame)
+        if self.profiler is not None:
+            frames = self.profiler.timed(frames, 'decode')
+        for frame_count, frame in frames:
+            if not self.running:
+                break
+            if self.profiler is not None:
+                self.profiler.count('frames_decoded')
+
+            if gate is not None:
+                started = time.perf_counter()
+                changed = gate.check(frame)
+                self.record('gate', started)
+                if not changed:
+                    yield frame_count, frame.shape[:2], None, False
+                    continue
+
+            started = time.perf_counter()
+            if not ring:
+                height, width = frame.shape[:2]
+                size = scaled_size(width, height, self.scale)
+                small_frame = np.empty((size[1], size[0], 3), dtype=np.uint8)
+                ring = [np.empty_like(small_frame) for _ in range(ring_size)]
+
+            small_frame = cv2.resize(frame, size, dst=small_frame)
+            rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB, dst=ring[prepared % ring_size])
+            self.record('resize', started)
+            prepared += 1
+            yield frame_count, frame.shape[:2], rgb_small_frame, gate is not None and gate.scene_cut
+
+    def collect_faces(self, frame_count, frame_size, face_locations, encodings,
+                      detections, unique_faces, clusterer):
+        height, width = frame_size
+        small_width, small_height = scaled_size(width, height, self.scale)
+        scale_x, scale_y = width / small_width, height / small_height
+        boxes = []
+        kept_encodings = []
+        for location, encoding in zip(face_locations, encodings):
+            top, bottom = int(round(location[0] * scale_y)), int(round(location[2] * scale_y))
+            right, left = int(round(location[1] * scale_x)), int(round(location[3] * scale_x))
+            top, bottom = max(top, 0), min(bottom, height)
+            left, right = max(left, 0), min(right, width)
+            if bottom > top and right > left:
+                boxes.append((top, right, bottom, left))
+                kept_encodings.append(encoding)
+
+        labels = self.assign_labels(kept_encodings, clusterer)
+        matched = np.flatnonzero(labels >= 0)
+        boxes = [boxes[i] for i in matched]
+        labels = labels[matched]
+        first_index = len(detections)
+        detections.append([frame_count] * len(boxes), boxes, [kept_encodings[i] for i in matched])
+
+        for offset, label in enumerate(labels):
+            index = first_index + offset
+            if label >= len(unique_faces):
+                unique_faces.append({'indices': [index]})
+            else:
+                unique_faces[label]['indices'].append(index)
+        return labels
+
+    def finish_clusters(self, unique_faces, clusterer):
+        if self.reference is not None:
+            for person in unique_faces:
+                person['indices'].sort()
+                person['encoding'] = self.reference.encodings.mean(axis=0)
+                person['face_index'] = person['indices'][0]
+            return unique_faces
+
+        if self.merge_clusters:
+            mapping = clusterer.merge()
+            merged = {}
+            for label, person in enumerate(unique_faces):
+                target = int(mapping[label])
+                if target in merged:
+                    merged[target]['indices'].extend(person['indices'])
+                else:
+                    merged[target] = person
+            unique_faces = [merged[label] for label in sorted(merged)]
+
+        for label, person in enumerate(unique_faces):
+            person['indices'].sort()
+            person['encoding'] = clusterer.centroids[label].copy()
+            person['face_index'] = person['indices'][0]
+        return unique_faces
+
+    def stop(self):
+        self.running = False
+
+
+class FaceDetectionThread(QThread):
+    progress_update = pyqtSignal(dict)
+    detection_finished = pyqtSignal(object, list, int, dict, dict)
+
+    def __init__(self, video_path, **options):
+        super().__init__()
+        progress = ProgressReporter(self.progress_update.emit)
+        self.detector = FaceDetector(video_path, progress_callback=progress.update, **options)
+
+    def run(self):
+        result = self.detector.run()
+        if result is not None:
+            self.detection_finished.emit(result['detections'], result['unique_faces'], result['total_frames'],
+                                         result['thumbnails'], result['stats'])
+
+    def stop(self):
+        self.detector.stop()
+
+
+class RegroupThread(QThread):
+    # Clusters a finished pass at every tolerance of the slider, nearest first,
+    # so that moving the slider afterwards only looks the people up
+    cut_ready = pyqtSignal(float)
+
+    def __init__(self, regrouper, tolerances):
+        super().__init__()
+        self.regrouper = regrouper
+        self.tolerances = tolerances
+        self.running = True
+
+    def run(self):
+        for tolerance in self.tolerances:
+            if not self.running:
+                return
+            self.regrouper.cut(tolerance)
+            self.cut_ready.emit(tolerance)
+
+    def stop(self):
+        self.running = False
+
+
+# x264 and x265 names of the profiles ffprobe reports
+X264_PROFILES = {
+    'Constrained Baseline': 'baseline',
+    'Baseline': 'baseline',
+    'Main': 'main',
+    'High': 'high',
+    'High 10': 'high10',
+    'High 4:2:2': 'high422',
+    'High 4:4:4 Predictive': 'high444',
+}
+X265_PROFILES = {
+    'Main': 'main',
+    'Main 10': 'main10',
+    'Main Still Picture': 'mainstillpicture',
+}
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+def probed_time(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def probe_video_stream(video_path):
+    # Codec parameters and start time of the first video stream, plus the start
+    # time of the file, which ffmpeg's -ss counts from
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+         "stream=codec_name,profile,level,pix_fmt,refs,start_time:format=start_time",
+         "-of", "json", video_path],
+        capture_output=True, text=True, check=True
+    )
+    probed = json.loads(result.stdout or "{}")
+    stream = (probed.get('streams') or [{}])[0]
+    stream['start_time'] = probed_time(stream.get('start_time'))
+    stream['file_start_time'] = probed_time(probed.get('format', {}).get('start_time'))
+    return stream
+
+
+def boundary_encoder(stream):
+    # ffmpeg arguments that re-encode the boundary GOPs of a frame-accurate copy
+    # with the profile, level, pixel format and reference frames of the source,
+    # or None if they cannot be matched. The concat keeps only the first
+    # piece's parameter sets, so every piece must decode with them. B-frames
+    # are left out so the encoder uses no more reference frames than asked.
+    codec = stream.get('codec_name')
+    profile = stream.get('profile')
+    pix_fmt = stream.get('pix_fmt')
+    level = int(stream.get('level') or 0)
+    refs = max(1, int(stream.get('refs') or 1))
+    if not pix_fmt:
+        return None
+    if codec == 'h264':
+        if profile not in X264_PROFILES or level <= 9:
+            return None
+        return ["-c:v", "libx264", "-profile:v", X264_PROFILES[profile], "-level", f"{level / 10:.1f}",
+                "-refs", str(refs), "-bf", "0", "-pix_fmt", pix_fmt]
+    if codec == 'hevc':
+        if profile not in X265_PROFILES or level <= 0:
+            return None
+        return ["-c:v", "libx265", "-profile:v", X265_PROFILES[profile], "-pix_fmt", pix_fmt,
+                "-x265-params", f"level-idc={level / 30:.1f}:ref={refs}:bframes=0"]
+    if codec == 'vp9':
+        # Reported as "Profile 0" to "Profile 3"
+        if not profile or not profile.startswith('Profile '):
+            return None
+        return ["-c:v", "libvpx-vp9", "-profile:v", profile.split()[-1], "-pix_fmt", pix_fmt]
+    if codec == 'vp8':
+        return ["-c:v", "libvpx", "-pix_fmt", pix_fmt]
+    if codec == 'mjpeg':
+        return ["-c:v", "mjpeg", "-pix_fmt", pix_fmt]
+    return None
+
+
+def probe_keyframes(video_path, start_time=0.0):
+    # Reads packet flags only, nothing is decoded. Times are counted from the
+    # stream's start_time, as frame numbers are.
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries", "packet=pts_time,flags",
+         "-of", "csv=p=0", video_path],
+        capture_output=True, text=True, check=True
+    )
+    keyframes = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time) - start_time)
+    return sorted(keyframes)
+
+
+def keyframe_pieces(frame_ranges, fps, keyframes, frame_accurate=False):
+    # Returns (start_time, end_time, reencode) pieces. Copied pieces start and end
+    # on keyframes, so no reordered frame of a cut GOP spills past either end.
+    # Ranges are widened to the surrounding keyframes, or with frame_accurate the
+    # partial GOPs at both ends are re-encoded instead.
+    keyframes = np.asarray(keyframes if keyframes else [0.0])
+    # Keyframe times and frame times are only equal up to rounding
+    slack = 0.5 / fps
+    pieces = []
+    for start, end in frame_ranges:
+        start_time = start / fps
+        end_time = (end + 1) / fps
+
+        if not frame_accurate:
+            before = keyframes[keyframes <= start_time + slack]
+            after = keyframes[keyframes >= end_time - slack]
+            pieces.append([float(before[-1]) if len(before) else min(float(keyframes[0]), start_time),
+                           float(after[0]) if len(after) else end_time, False])
+            continue
+
+        inside = keyframes[(keyframes > start_time - slack) & (keyframes < end_time + slack)]
+        if len(inside) == 0:
+            pieces.append([start_time, end_time, True])
+            continue
+        first, last = float(inside[0]), float(inside[-1])
+        if first - start_time > slack:
+            pieces.append([start_time, first, True])
+        if last > first:
+            pieces.append([first, last, False])
+        if end_time - last > slack:
+            pieces.append([last, end_time, True])
+
+    merged = []
+    for piece in pieces:
+        if merged and not piece[2] and not merged[-1][2] and piece[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], piece[1])
+        else:
+            merged.append(piece)
+    return [tuple(piece) for piece in merged]
+
+
+def run_ffmpeg(arguments, is_running):
+    process = subprocess.Popen(["ffmpeg", "-v", "error", "-y"] + arguments,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    while process.poll() is None:
+        if not is_running():
+            process.kill()
+            process.wait()
+            return False
+        time.sleep(0.05)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.read().decode(errors="replace").strip())
+    return True
+
+
+def concat_files(paths, output_path, is_running):
+    list_path = output_path + ".concat.txt"
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        return run_ffmpeg(["-f", "concat", "-safe", "0", "-i", list_path, "-map", "0", "-c", "copy",
+                           output_path], is_running)
+    finally:
+        os.remove(list_path)
+
+
+def stream_copy_export(video_path, output_path, frame_ranges, fps, frame_accurate=False,
+                       progress_callback=None, is_running=lambda: True):
+    stream = probe_video_stream(video_path)
+    encoder = boundary_encoder(stream) if frame_accurate else None
+    if frame_accurate and encoder is None:
+        raise RuntimeError(f"Cannot re-encode {stream.get('codec_name')} ({stream.get('profile')}) "
+                           "with the parameters of the source for frame-accurate cuts")
+    pieces = keyframe_pieces(frame_ranges, fps, probe_keyframes(video_path, stream['start_time']),
+                             frame_accurate)
+    # Piece times count from the first video frame, -ss from the start of the file
+    offset = stream['start_time'] - stream['file_start_time']
+    total_duration = sum(end - start for start, end, _ in pieces) or 1.0
+    extension = os.path.splitext(output_path)[1] or ".mkv"
+
+    temp_dir = tempfile.mkdtemp(prefix="face_cutter_")
+    try:
+        piece_paths = []
+        done_duration = 0.0
+        for number, (start, end, reencode) in enumerate(pieces):
+            piece_path = os.path.join(temp_dir, f"piece_{number:05d}{extension}")
+            codec_arguments = encoder + ["-c:a", "copy"] if reencode else ["-c", "copy"]
+            completed = run_ffmpeg(
+                ["-ss", f"{start + offset:.6f}", "-i", video_path, "-t", f"{end - start:.6f}",
+                 "-map", "0:v:0", "-map", "0:a?"] + codec_arguments +
+                ["-avoid_negative_ts", "make_zero", piece_path],
+                is_running
+            )
+            if not completed:
+                return False
+            piece_paths.append(piece_path)
+
+            done_duration += end - start
+            if progress_callback:
+                progress_callback(int(done_duration * fps), int(total_duration * fps))
+
+        return concat_files(piece_paths, output_path, is_running) if piece_paths else False
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+# Below this many frames per worker a parallel export is not worth the process start-up
+MIN_CHUNK_FRAMES = 250
+
+
+def open_writer(path, codec, fps, size):
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, size, isColor=True)
+    return out if out.isOpened() else None
+
+
+def write_ranges(cap, out, frame_ranges, on_frame=None, is_running=lambda: True, profiler=None):
+    written_frames = 0
+    position = 0
+    for start, end in frame_ranges:
+        if not is_running():
+            break
+
+        started = time.perf_counter()
+        position = advance_to(cap, position, start)
+        if profiler is not None:
+            profiler.add('export_seek', time.perf_counter() - started)
+        while position <= end and is_running():
+            started = time.perf_counter()
             ret, frame = cap.read()
             if not ret:
                 break
+            decoded = time.perf_counter()
+            out.write(frame)
+            if profiler is not None:
+                profiler.add('export_decode', decoded - started)
+                profiler.add('export_write', time.perf_counter() - decoded)
+                profiler.count('frames_written')
+            position += 1
+            written_frames += 1
+            if on_frame:
+                on_frame(written_frames)
+    return written_frames
 
-            if frame_count % self.sample_interval == 0:
-                small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-                rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-                
-                face_locations = face_recognition.face_locations(rgb_small_frame)
-                encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
-            
-                for (top, right, bottom, left), encoding in zip(face_locations, encodings):
-                    top *= 4
-                    right *= 4
-                    bottom *= 4
-                    left *= 4
-                    
-                    face_img = frame[top:bottom, left:right]
-                    if face_img.size > 0:
-                        all_faces.append(face_img)
-                        face_encodings.append(encoding)
-                        face_frames.append(frame_count)
-                        
-                        if not unique_faces:
-                            unique_faces.append({
-                                'encoding': encoding,
-                                'face_img': face_img,
-                                'indices': [len(all_faces) - 1]
-                            })
-                        else:
-                            matched = False
-                            for person in unique_faces:
-                                if face_recognition.compare_faces([person['encoding']], encoding, tolerance=self.face_tolerance)[0]:
-                                    person['indices'].append(len(all_faces) - 1)
-                                    matched = True
-                                    break
-                            
-                            if not matched:
-                                unique_faces.append({
-                                    'encoding': encoding,
-                                    'face_img': face_img,
-                                    'indices': [len(all_faces) - 1]
-                                })
-
-                processed_frames += 1
-            
-            frame_count += 1
 
-            progress = int((frame_count / total_frames) * 100)
-            self.progress_update.emit(progress)
-            
-        cap.release()
-        
-        if self.running:
-            self.detection_finished.emit(all_faces, face_encodings, face_frames, unique_faces, total_frames)
-    
+def split_ranges(frame_ranges, chunks):
+    # Splits the ranges into `chunks` ordered groups of roughly equal length
+    total = sum(end - start + 1 for start, end in frame_ranges)
+    target = max(1, -(-total // max(1, chunks)))
+    groups = [[]]
+    filled = 0
+    for start, end in frame_ranges:
+        while start <= end:
+            if filled == target:
+                groups.append([])
+                filled = 0
+            stop = min(end, start + target - filled - 1)
+            groups[-1].append((start, stop))
+            filled += stop - start + 1
+            start = stop + 1
+    return [group for group in groups if group]
+
+
+# Set in each export worker by _init_export_worker
+_export_progress = None
+_export_cancel = None
+EXPORT_PROGRESS_STEP = 25
+
+
+def _init_export_worker(progress_queue, cancel_event):
+    global _export_progress, _export_cancel
+    _export_progress = progress_queue
+    _export_cancel = cancel_event
+
+
+def _export_chunk(video_path, chunk_path, frame_ranges, codec):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return False
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    out = open_writer(chunk_path, codec, cap.get(cv2.CAP_PROP_FPS), size)
+    if out is None:
+        cap.release()
+        return False
+
+    def report(written_frames):
+        if written_frames % EXPORT_PROGRESS_STEP == 0:
+            _export_progress.put(EXPORT_PROGRESS_STEP)
+
+    written_frames = write_ranges(cap, out, frame_ranges, report, lambda: not _export_cancel.is_set())
+    _export_progress.put(written_frames % EXPORT_PROGRESS_STEP)
+    cap.release()
+    out.release()
+    return not _export_cancel.is_set()
+
+
+def parallel_export(video_path, output_path, frame_ranges, codec, workers,
+                    progress_callback=None, is_running=lambda: True):
+    # Each worker encodes its own chunk file; the chunks are joined in order
+    context = multiprocessing.get_context("spawn")
+    progress_queue = context.Queue()
+    cancel_event = context.Event()
+    total_frames = sum(end - start + 1 for start, end in frame_ranges) or 1
+    extension = os.path.splitext(output_path)[1] or ".avi"
+
+    temp_dir = tempfile.mkdtemp(prefix="face_cutter_", dir=os.path.dirname(os.path.abspath(output_path)))
+    try:
+        chunks = split_ranges(frame_ranges, workers)
+        chunk_paths = [os.path.join(temp_dir, f"chunk_{number:05d}{extension}") for number in range(len(chunks))]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_export_worker,
+                                 initargs=(progress_queue, cancel_event)) as executor:
+            futures = [executor.submit(_export_chunk, video_path, path, chunk, codec)
+                       for path, chunk in zip(chunk_paths, chunks)]
+
+            written_frames = 0
+            while not all(future.done() for future in futures):
+                if not is_running():
+                    cancel_event.set()
+                try:
+                    written_frames += progress_queue.get(timeout=0.1)
+                    while True:
+                        written_frames += progress_queue.get_nowait()
+                except queue.Empty:
+                    pass
+                if progress_callback:
+                    progress_callback(min(written_frames, total_frames), total_frames)
+
+            if not all(future.result() for future in futures) or not is_running():
+                return False
+
+        if shutil.which("ffmpeg") is not None:
+            return concat_files(chunk_paths, output_path, is_running)
+        return concat_with_opencv(chunk_paths, output_path, codec, is_running)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def concat_with_opencv(paths, output_path, codec, is_running=lambda: True):
+    # Fallback without ffmpeg: the chunks are decoded and encoded once more
+    out = None
+    for path in paths:
+        cap = cv2.VideoCapture(path)
+        if out is None:
+            size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            out = open_writer(output_path, codec, cap.get(cv2.CAP_PROP_FPS), size)
+            if out is None:
+                cap.release()
+                return False
+        while is_running():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(frame)
+        cap.release()
+    if out is not None:
+        out.release()
+    return out is not None and is_running()
+
+
+def _profiled_progress(progress_callback, profiler):
+    def report(done, total):
+        started = time.perf_counter()
+        if progress_callback:
+            progress_callback(done, total)
+        profiler.add('export_progress', time.perf_counter() - started)
+        profiler.sample_memory('export')
+    return report
+
+
+def export_video(video_path, output_path, frame_ranges, codec, frame_accurate=False, workers=1,
+                 progress_callback=None, is_running=lambda: True, profiler=None):
+    if profiler is not None:
+        progress_callback = _profiled_progress(progress_callback, profiler)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return False
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    total_frames = sum(end - start + 1 for start, end in frame_ranges)
+
+    try:
+        started = time.perf_counter()
+        if codec == "copy":
+            cap.release()
+            completed = stream_copy_export(video_path, output_path, frame_ranges, fps, frame_accurate,
+                                           progress_callback, is_running)
+            if profiler is not None:
+                profiler.add('export_copy', time.perf_counter() - started)
+            return completed
+
+        # Without ffmpeg the chunks would have to be decoded and encoded again to be joined
+        if workers > 1 and total_frames >= workers * MIN_CHUNK_FRAMES and shutil.which("ffmpeg") is not None:
+            cap.release()
+            completed = parallel_export(video_path, output_path, frame_ranges, codec, workers,
+                                        progress_callback, is_running)
+            if profiler is not None:
+                profiler.add('export_parallel', time.perf_counter() - started)
+            return completed
+    except (OSError, RuntimeError, subprocess.CalledProcessError):
+        return False
+
+    out = open_writer(output_path, codec, fps, (width, height))
+    if out is None:
+        cap.release()
+        return False
+
+    def report(written_frames):
+        if progress_callback:
+            progress_callback(written_frames, total_frames)
+
+    write_ranges(cap, out, frame_ranges, report, is_running, profiler)
+
+    cap.release()
+    out.release()
+    return is_running()
+
+
+class VideoWriterThread(QThread):
+    progress_update = pyqtSignal(dict)
+    cutting_finished = pyqtSignal(str)
+    
+    def __init__(self, video_path, output_path, frame_ranges, codec, frame_accurate=False, workers=1,
+                 profiler=None):
+        super().__init__()
+        self.video_path = video_path
+        self.output_path = output_path
+        self.frame_ranges = frame_ranges
+        self.codec = codec
+        self.frame_accurate = frame_accurate
+        self.workers = workers
+        self.profiler = profiler
+        self.running = True
+        
+    def run(self):
+        progress = ProgressReporter(self.progress_update.emit)
+        completed = export_video(self.video_path, self.output_path, self.frame_ranges, self.codec,
+                                 self.frame_accurate, self.workers, progress.update,
+                                 lambda: self.running, self.profiler)
+        if self.running:
+            self.cutting_finished.emit(self.codec if completed else "Failed")
+    
+    def stop(self):
+        self.running = False
+
+
+class DetectionQueue:
+    # Detects (and optionally exports) many videos, a few at a time, under one
+    # worker budget: each video takes a share of the free workers when it
+    # starts and gives it back when done. People found are registered in the
+    # person index, so IDs agree across videos. Jobs are dicts as made by
+    # batch_jobs; a job with 'persons' (index IDs) and an 'output' exports
+    # those people from that video.
+
+    def __init__(self, jobs, worker_budget, concurrent=2, detector_options=None, export_options=None,
+                 person_index=None, progress_callback=None, job_callback=None):
+        self.jobs = list(jobs)
+        self.worker_budget = max(1, worker_budget)
+        self.concurrent = max(1, min(concurrent, len(self.jobs)))
+        self.detector_options = detector_options or {}
+        self.export_options = export_options or {}
+        self.person_index = person_index
+        self.progress_callback = progress_callback
+        self.job_callback = job_callback
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.workers_in_use = 0
+        self.active = 0
+        self.progress = {}
+        self.detectors = {}
+        self.failures = 0
+        self.running = True
+
+    def run(self):
+        for index, job in enumerate(self.jobs):
+            self.pending.put((index, job))
+        threads = [threading.Thread(target=self.work, daemon=True) for _ in range(self.concurrent)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.failures
+
+    def work(self):
+        while self.running:
+            try:
+                index, job = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            workers = self.acquire_workers()
+            try:
+                result = self.run_job(index, job, workers)
+            finally:
+                self.release_workers(workers)
+            with self.lock:
+                if result is None or result.get('failed'):
+                    self.failures += 1
+            if self.job_callback and self.running:
+                self.job_callback(job, result)
+
+    def acquire_workers(self):
+        # Leaves an equal share for the idle threads that will start a video too
+        with self.lock:
+            starting = 1 + min(self.concurrent - self.active - 1, self.pending.qsize())
+            workers = max(1, (self.worker_budget - self.workers_in_use) // starting)
+            self.workers_in_use += workers
+            self.active += 1
+            return workers
+
+    def release_workers(self, workers):
+        with self.lock:
+            self.workers_in_use -= workers
+            self.active -= 1
+
+    def run_job(self, index, job, workers):
+        video_path = job['video']
+        persons = job.get('persons')
+        reference = None
+        if persons and self.person_index is not None:
+            reference = self.person_index.gallery([person - 1 for person in persons])
+
+        detector = FaceDetector(video_path, workers=workers, reference=reference,
+                                progress_callback=lambda done, total, stages=None: self.report(index, done, total),
+                                **self.detector_options)
+        with self.lock:
+            self.detectors[index] = detector
+        try:
+            result = detector.run()
+        finally:
+            with self.lock:
+                del self.detectors[index]
+        if result is None or not self.running:
+            return result
+
+        if reference is None and self.person_index is not None and not result['stats']['partial']:
+            ids = self.person_index.register(video_path, [person['encoding'] for person in result['unique_faces']],
+                                             detector.face_tolerance)
+            for person, person_id in zip(result['unique_faces'], ids.tolist()):
+                person['person_id'] = person_id
+
+        if reference is not None and job.get('output') and result['unique_faces']:
+            result['failed'] = not self.export(video_path, job['output'], result, detector, workers)
+        return result
+
+    def export(self, video_path, output_path, result, detector, workers):
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        cap.release()
+
+        options = self.export_options
+        sample_interval = sampling_step(fps, detector.sample_interval, detector.analyses_per_second)
+        timeline = PersonTimeline(result['detections'], result['unique_faces'], sample_interval, result['total_frames'])
+        frame_ranges = timeline.select([0]).padded(options.get('padding', 0), options.get('merge_gap', 0),
+                                                   result['total_frames']).ranges()
+        return export_video(video_path, output_path, frame_ranges, options.get('codec', 'mp4v'),
+                            options.get('frame_accurate', False), workers, is_running=lambda: self.running)
+
+    def report(self, index, done, total):
+        if self.progress_callback is None:
+            return
+        with self.lock:
+            self.progress[index] = (done, total)
+            self.progress_callback(sum(done for done, _ in self.progress.values()),
+                                   sum(total for _, total in self.progress.values()))
+
     def stop(self):
         self.running = False
+        with self.lock:
+            for detector in self.detectors.values():
+                detector.stop()
 
 
-class VideoWriterThread(QThread):
-    progress_update = pyqtSignal(int)
-    cutting_finished = pyqtSignal(str)
-    
-    def __init__(self, video_path, output_path, selected_frames, codec, sample_interval=1):
+class DetectionQueueThread(QThread):
+    progress_update = pyqtSignal(dict)
+    video_finished = pyqtSignal(dict, object)
+    queue_finished = pyqtSignal(int)
+
+    def __init__(self, jobs, worker_budget, **options):
         super().__init__()
-        self.video_path = video_path
-        self.output_path = output_path
-        self.selected_frames = selected_frames
-        self.codec = codec
-        self.sample_interval = sample_interval  # Novo parâmetro
-        self.running = True
-        
+        progress = ProgressReporter(self.progress_update.emit)
+        self.queue = DetectionQueue(jobs, worker_budget, progress_callback=progress.update,
+                                    job_callback=self.report_job, **options)
+
     def run(self):
-        cap = cv2.VideoCapture(self.video_path)
-        if not cap.isOpened():
-            return
-        
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        
-        fourcc = cv2.VideoWriter_fourcc(*self.codec)
-        out = cv2.VideoWriter(self.output_path, fourcc, fps, (width, height), isColor=True)
-        
-        selected_frame_ranges = []
-        current_range_start = None
-        last_selected_frame = None
+        failures = self.queue.run()
+        if self.queue.running:
+            self.queue_finished.emit(failures)
 
-        sorted_frames = sorted(self.selected_frames)
-        
-        for frame in sorted_frames:
-            if current_range_start is None:
-                current_range_start = frame
-                last_selected_frame = frame
-            elif frame - last_selected_frame > self.sample_interval:
-                selected_frame_ranges.append((current_range_start, last_selected_frame))
-                current_range_start = frame
-            
-            last_selected_frame = frame
+    def report_job(self, job, result):
+        # Only a summary crosses the thread boundary, not the detection table
+        if result is not None:
+            result = {
+                'people': [person.get('person_id') for person in result['unique_faces']],
+                'stats': result['stats'],
+                'failed': result.get('failed', False)
+            }
+        self.video_finished.emit(job, result)
+
+    def stop(self):
+        self.queue.stop()
+
+
+FACE_DETECTORS = [
+    ("HOG (face_recognition default)", "hog"),
+    ("CNN (dlib, more accurate, slow without a GPU)", "cnn"),
+    ("YuNet (OpenCV DNN, fast on CPU)", "yunet"),
+]
 
-        if current_range_start is not None:
-            selected_frame_ranges.append((current_range_start, last_selected_frame))
+# (label, pixel budget, smallest face in source pixels that must still be found)
+DETECTION_RESOLUTIONS = [
+    ("Balanced (about 640x360)", DEFAULT_PIXEL_BUDGET, None),
+    ("Fast (about 480x270)", 480 * 270, None),
+    ("Accurate (about 1280x720)", 1280 * 720, None),
+    ("Small faces (down to 40 px)", DEFAULT_PIXEL_BUDGET, 40),
+    ("Large faces only (80 px and up)", DEFAULT_PIXEL_BUDGET, 80),
+]
+EXPORT_CODECS = [
+    ("H.264 (Recommended for MP4)", "avc1"),
+    ("XVID (Recommended for AVI)", "XVID"),
+    ("MPEG-4 (Recommended for MOV)", "mp4v"),
+    ("MJPG (High quality, large files)", "MJPG"),
+    ("FFV1 (Lossless, very large files)", "FFV1"),
+    ("Copy (no re-encode, keeps audio, needs ffmpeg)", "copy"),
+]
+VIDEO_FORMATS = [".mp4", ".avi", ".mov", ".mkv"]
 
-        if not out.isOpened():
-            self.cutting_finished.emit("Failed")
+TIMELINE_COLORS = [(66, 133, 244), (219, 68, 55), (244, 180, 0), (15, 157, 88), (171, 71, 188), (0, 172, 193)]
+PREVIEW_WIDTH = 480
+
+
+class TimelineWidget(QWidget):
+    # One bar per row of (label, SegmentList, (r, g, b)) across the whole video,
+    # with the preview position as a vertical line. Clicking asks to seek there.
+    seek_requested = pyqtSignal(int)
+
+    def __init__(self):
+        super().__init__()
+        self.rows = []
+        self.total_frames = 0
+        self.position = None
+        self.setMinimumHeight(48)
+
+    def set_rows(self, rows, total_frames):
+        self.rows = rows
+        self.total_frames = total_frames
+        self.setToolTip("\n".join(label for label, _, _ in rows))
+        self.update()
+
+    def set_position(self, frame):
+        self.position = frame
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(45, 45, 45))
+        if not self.rows or self.total_frames <= 0:
             return
-        
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        frame_count = 0
-        
-        while cap.isOpened() and self.running:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            if frame_count in self.selected_frames:
-                out.write(frame)
-            
-            frame_count += 1
-            progress = int((frame_count / total_frames) * 100)
-            self.progress_update.emit(progress)
-        
-        cap.release()
-        out.release()
-        
-        if self.running:
-            self.cutting_finished.emit(self.codec)
-    
-    def stop(self):
-        self.running = False
+
+        width = self.width()
+        row_height = self.height() / len(self.rows)
+        for row, (_, segments, color) in enumerate(self.rows):
+            top = int(row * row_height) + 1
+            for start, end in segments.ranges():
+                left = int(start * width / self.total_frames)
+                right = max(left + 1, int((end + 1) * width / self.total_frames))
+                painter.fillRect(left, top, right - left, max(1, int(row_height) - 2), QColor(*color))
+
+        if self.position is not None:
+            x = int(self.position * width / self.total_frames)
+            painter.fillRect(x, 0, 2, self.height(), QColor(255, 255, 255))
+
+    def mousePressEvent(self, event):
+        if self.total_frames > 0 and self.width() > 0:
+            frame = int(event.position().x() * self.total_frames / self.width())
+            self.seek_requested.emit(min(max(frame, 0), self.total_frames - 1))
 
 
 class FaceBasedVideoCutter(QWidget):
@@ -176,15 +2612,36 @@ class FaceBasedVideoCutter(QWidget):
         self.setGeometry(100, 100, 800, 800)
         
         self.video_path = None
-        self.all_faces = []
-        self.face_encodings = []
-        self.face_frames = []
+        self.video_fps = 0.0
+        self.detections = DetectionTable()
+        self.thumbnails = ThumbnailCache()
         self.unique_faces = []
+        self.regrouper = None
+        self.regroup_merge = None
+        self.grouped_tolerance = None
+        self.detection_step = 1
+        self.total_frames = 0
         self.selected_persons = set()
         self.face_tolerance = 0.7
+        self.encoding_cache = EncodingCache()
+        self.reference_gallery = None
+        self.yunet_model = None
+        self.person_index = PersonIndex()
+        self.partial_detection = False
+        self.profiler = None
         
         self.detection_thread = None
+        self.regroup_thread = None
         self.writer_thread = None
+        self.queue_thread = None
+
+        self.timeline = None
+        self.preview_timer = QTimer(self)
+        self.preview_timer.timeout.connect(self.show_preview_frame)
+        self.preview_cap = None
+        self.preview_segments = None
+        self.preview_position = 0
+        self.preview_frame = 0
         
         self.setup_ui()
         
@@ -211,6 +2668,7 @@ class FaceBasedVideoCutter(QWidget):
         self.tolerance_slider.setTickInterval(1)
         self.tolerance_slider.setTickPosition(QSlider.TickPosition.TicksBelow)
         self.tolerance_slider.valueChanged.connect(self.update_tolerance)
+        self.tolerance_slider.sliderReleased.connect(self.regroup_people)
         tolerance_container.addWidget(self.tolerance_slider)
 
         tolerance_description = QLabel("Lower = More differentiation between people | Higher = More similar people grouped")
@@ -221,6 +2679,12 @@ class FaceBasedVideoCutter(QWidget):
         settings_group.setLayout(settings_layout)
         main_layout.addWidget(settings_group)
 
+        self.sampling_mode_combo = QComboBox()
+        self.sampling_mode_combo.addItem("Every N frames", "frames")
+        self.sampling_mode_combo.addItem("N analyses per second of video", "time")
+        self.sampling_mode_combo.currentIndexChanged.connect(self.update_sampling_mode)
+        settings_layout.addRow("Sampling Mode:", self.sampling_mode_combo)
+
         self.sample_interval_label = QLabel("Frame Sampling Interval: 1")
         settings_layout.addRow(self.sample_interval_label)
 
@@ -232,9 +2696,72 @@ class FaceBasedVideoCutter(QWidget):
         self.sample_interval_slider.valueChanged.connect(self.update_sample_interval)
         settings_layout.addRow(self.sample_interval_slider)
 
-        sample_description = QLabel("1 = All frames | 10 = Only 1 in every 10 frames")
-        sample_description.setWordWrap(True)
-        settings_layout.addRow(sample_description)
+        self.sample_description = QLabel("1 = All frames | 10 = Only 1 in every 10 frames")
+        self.sample_description.setWordWrap(True)
+        settings_layout.addRow(self.sample_description)
+
+        self.merge_checkbox = QCheckBox("Merge similar people after detection")
+        self.merge_checkbox.setChecked(True)
+        settings_layout.addRow(self.merge_checkbox)
+
+        self.tracking_checkbox = QCheckBox("Track faces between samples (encode only new faces)")
+        self.tracking_checkbox.setChecked(True)
+        settings_layout.addRow(self.tracking_checkbox)
+
+        self.gating_checkbox = QCheckBox("Skip unchanged frames (analyse densely only around shot changes)")
+        self.gating_checkbox.setChecked(True)
+        settings_layout.addRow(self.gating_checkbox)
+
+        self.resolution_combo = QComboBox()
+        for label, pixel_budget, target_face_size in DETECTION_RESOLUTIONS:
+            self.resolution_combo.addItem(label, (pixel_budget, target_face_size))
+        settings_layout.addRow("Detection Resolution:", self.resolution_combo)
+
+        self.roi_checkbox = QCheckBox("Search only around known faces (full frame every 10 analyses)")
+        settings_layout.addRow(self.roi_checkbox)
+
+        self.detector_combo = QComboBox()
+        for label, name in FACE_DETECTORS:
+            self.detector_combo.addItem(label, name)
+        self.detector_combo.currentIndexChanged.connect(self.update_detector)
+        settings_layout.addRow("Face Detector:", self.detector_combo)
+
+        self.batch_size_spin = QSpinBox()
+        self.batch_size_spin.setRange(1, 32)
+        self.batch_size_spin.setValue(4)
+        settings_layout.addRow("Frames per Batch:", self.batch_size_spin)
+
+        self.cache_checkbox = QCheckBox("Reuse cached detections (tolerance changes skip re-analysis)")
+        self.cache_checkbox.setChecked(True)
+        settings_layout.addRow(self.cache_checkbox)
+
+        self.index_checkbox = QCheckBox("Match people across videos (same person, same number in every video)")
+        self.index_checkbox.setChecked(True)
+        settings_layout.addRow(self.index_checkbox)
+
+        self.min_face_spin = QSpinBox()
+        self.min_face_spin.setRange(0, 1000)
+        self.min_face_spin.setSuffix(" px")
+        settings_layout.addRow("Minimum Face Size:", self.min_face_spin)
+
+        reference_layout = QHBoxLayout()
+        self.reference_button = QPushButton("Reference Photos...")
+        self.reference_button.clicked.connect(self.load_reference)
+        reference_layout.addWidget(self.reference_button)
+        self.clear_reference_button = QPushButton("Clear Reference")
+        self.clear_reference_button.clicked.connect(self.clear_reference)
+        self.clear_reference_button.setEnabled(False)
+        reference_layout.addWidget(self.clear_reference_button)
+        settings_layout.addRow(reference_layout)
+
+        self.reference_label = QLabel("No reference: all people are grouped automatically")
+        self.reference_label.setWordWrap(True)
+        settings_layout.addRow(self.reference_label)
+
+        self.workers_spin = QSpinBox()
+        self.workers_spin.setRange(1, os.cpu_count() or 1)
+        self.workers_spin.setValue(os.cpu_count() or 1)
+        settings_layout.addRow("Detection Workers:", self.workers_spin)
         
         control_layout = QHBoxLayout()
         self.detect_button = QPushButton("Detect Faces and People")
@@ -247,17 +2774,40 @@ class FaceBasedVideoCutter(QWidget):
         self.cancel_button.setEnabled(False)
         control_layout.addWidget(self.cancel_button)
         main_layout.addLayout(control_layout)
+
+        queue_layout = QHBoxLayout()
+        self.queue_button = QPushButton("Queue Videos...")
+        self.queue_button.clicked.connect(self.queue_videos)
+        queue_layout.addWidget(self.queue_button)
+        self.export_across_button = QPushButton("Export Across Videos...")
+        self.export_across_button.clicked.connect(self.export_across_videos)
+        self.export_across_button.setEnabled(False)
+        queue_layout.addWidget(self.export_across_button)
+        main_layout.addLayout(queue_layout)
         
         self.status_log = QTextEdit()
         self.status_log.setReadOnly(True)
         self.status_log.setMinimumHeight(80)
         self.status_log.setMaximumHeight(120)
+        self.status_log.document().setMaximumBlockCount(LOG_HISTORY_LIMIT)
         self.status_log.append("Status: Waiting for video...")
         main_layout.addWidget(self.status_log)
 
+        # Running progress is shown on this one line instead of being logged
+        self.progress_label = QLabel("")
+        main_layout.addWidget(self.progress_label)
+
+        log_layout = QHBoxLayout()
         self.clear_log_button = QPushButton("Clear Logs")
         self.clear_log_button.clicked.connect(lambda: self.status_log.clear())
-        main_layout.addWidget(self.clear_log_button)
+        log_layout.addWidget(self.clear_log_button)
+        self.profile_checkbox = QCheckBox("Collect profiling data")
+        log_layout.addWidget(self.profile_checkbox)
+        self.profile_button = QPushButton("Profile...")
+        self.profile_button.clicked.connect(self.show_profile)
+        self.profile_button.setEnabled(False)
+        log_layout.addWidget(self.profile_button)
+        main_layout.addLayout(log_layout)
         
         self.detection_info = QLabel("Total Frames: 0 | Frames with Faces: 0 | Total Faces: 0 | People: 0")
         main_layout.addWidget(self.detection_info)
@@ -268,22 +2818,63 @@ class FaceBasedVideoCutter(QWidget):
         self.scroll_layout = QGridLayout(self.scroll_content)
         self.scroll_area.setWidget(self.scroll_content)
         main_layout.addWidget(self.scroll_area)
+
+        timeline_group = QGroupBox("Timeline")
+        timeline_layout = QVBoxLayout()
+        self.timeline_widget = TimelineWidget()
+        self.timeline_widget.seek_requested.connect(self.seek_preview)
+        timeline_layout.addWidget(self.timeline_widget)
+
+        self.preview_label = QLabel()
+        self.preview_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.preview_label.hide()
+        timeline_layout.addWidget(self.preview_label)
+
+        preview_layout = QHBoxLayout()
+        self.preview_button = QPushButton("Preview Segments")
+        self.preview_button.clicked.connect(self.toggle_preview)
+        self.preview_button.setEnabled(False)
+        preview_layout.addWidget(self.preview_button)
+        self.together_checkbox = QCheckBox("Only where all selected people appear together")
+        self.together_checkbox.toggled.connect(self.update_timeline)
+        preview_layout.addWidget(self.together_checkbox)
+        timeline_layout.addLayout(preview_layout)
+
+        self.timeline_info = QLabel("Select people to see their segments")
+        timeline_layout.addWidget(self.timeline_info)
+        timeline_group.setLayout(timeline_layout)
+        main_layout.addWidget(timeline_group)
         
         export_group = QGroupBox("Export Settings")
         export_layout = QFormLayout()
 
         self.codec_combo = QComboBox()
-        self.codec_combo.addItem("H.264 (Recommended for MP4)", "avc1")
-        self.codec_combo.addItem("XVID (Recommended for AVI)", "XVID")
-        self.codec_combo.addItem("MPEG-4 (Recommended for MOV)", "mp4v")
-        self.codec_combo.addItem("MJPG (High quality, large files)", "MJPG")
-        self.codec_combo.addItem("FFV1 (Lossless, very large files)", "FFV1")
+        for label, codec in EXPORT_CODECS:
+            self.codec_combo.addItem(label, codec)
+        self.codec_combo.currentIndexChanged.connect(self.update_export_mode)
         export_layout.addRow("Codec:", self.codec_combo)
 
+        self.frame_accurate_checkbox = QCheckBox("Frame-accurate cuts (re-encode only the boundary GOPs)")
+        self.frame_accurate_checkbox.setEnabled(False)
+        export_layout.addRow(self.frame_accurate_checkbox)
+
+        self.export_workers_spin = QSpinBox()
+        self.export_workers_spin.setRange(1, os.cpu_count() or 1)
+        self.export_workers_spin.setValue(os.cpu_count() or 1)
+        export_layout.addRow("Export Workers:", self.export_workers_spin)
+
         self.format_combo = QComboBox()
-        self.format_combo.addItems([".mp4", ".avi", ".mov", ".mkv"])
+        self.format_combo.addItems(VIDEO_FORMATS)
         export_layout.addRow("Format:", self.format_combo)
 
+        self.padding_spin = QSpinBox()
+        self.padding_spin.setRange(0, 1000)
+        export_layout.addRow("Segment Padding (frames):", self.padding_spin)
+
+        self.merge_gap_spin = QSpinBox()
+        self.merge_gap_spin.setRange(0, 10000)
+        export_layout.addRow("Merge Gaps Up To (frames):", self.merge_gap_spin)
+
         export_group.setLayout(export_layout)
         main_layout.addWidget(export_group)
         
@@ -298,8 +2889,71 @@ class FaceBasedVideoCutter(QWidget):
         self.face_tolerance = value / 10.0
         self.tolerance_label.setText(f"Similarity Tolerance: {self.face_tolerance:.1f}")
 
+        # Dragging only regroups once the slider is released
+        if not self.tolerance_slider.isSliderDown():
+            self.regroup_people()
+
+    def start_regrouping(self):
+        # Right after detection every slider position is clustered in the background
+        self.stop_regrouping()
+        self.regrouper = Regrouper(self.detections.frame_indices, self.detections.encodings, self.regroup_merge)
+        tolerances = [value / 10.0 for value in range(self.tolerance_slider.minimum(),
+                                                      self.tolerance_slider.maximum() + 1)]
+        tolerances.sort(key=lambda tolerance: abs(tolerance - self.face_tolerance))
+        self.regroup_thread = RegroupThread(self.regrouper, tolerances)
+        self.regroup_thread.cut_ready.connect(self.regroup_ready)
+        self.regroup_thread.start()
+
+    def stop_regrouping(self):
+        if self.regroup_thread and self.regroup_thread.isRunning():
+            self.regroup_thread.stop()
+            self.regroup_thread.wait()
+        self.regrouper = None
+
+    def closeEvent(self, event):
+        self.stop_regrouping()
+        super().closeEvent(event)
+
+    def regroup_ready(self, tolerance):
+        # A tolerance picked before its people were clustered is shown once they are
+        if self.sender().regrouper is self.regrouper and not self.tolerance_slider.isSliderDown():
+            self.regroup_people()
+
+    def regroup_people(self):
+        if self.regroup_merge is None or self.face_tolerance == self.grouped_tolerance:
+            return
+        if not self.regrouper.ready(self.face_tolerance):
+            self.log_status(f"Grouping people with tolerance {self.face_tolerance:.1f}...")
+            return
+        self.unique_faces = self.regrouper.people(self.face_tolerance)
+        self.grouped_tolerance = self.face_tolerance
+        self.index_people(register=False)
+        self.build_timeline()
+        self.selected_persons.clear()
+        self.cut_button.setEnabled(False)
+        self.export_across_button.setEnabled(False)
+        self.log_status(f"{len(self.unique_faces)} people with tolerance {self.face_tolerance:.1f}. Select one or more:")
+        self.update_detection_info()
+        self.display_unique_faces()
+
     def update_sample_interval(self, value):
-        self.sample_interval_label.setText(f"Intervalo de Amostragem de Quadros: {value}")
+        if self.sampling_mode_combo.currentData() == "time":
+            self.sample_interval_label.setText(f"Analyses per Second: {value}")
+        else:
+            self.sample_interval_label.setText(f"Frame Sampling Interval: {value}")
+
+    def update_sampling_mode(self):
+        if self.sampling_mode_combo.currentData() == "time":
+            self.sample_description.setText("1 = One analysis per second | 10 = Ten analyses per second")
+        else:
+            self.sample_description.setText("1 = All frames | 10 = Only 1 in every 10 frames")
+        self.update_sample_interval(self.sample_interval_slider.value())
+
+    def sampling_settings(self):
+        value = self.sample_interval_slider.value()
+        if self.sampling_mode_combo.currentData() == "time":
+            return sampling_step(self.video_fps, analyses_per_second=value), value
+        return value, None
 
     def load_video(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -322,6 +2976,7 @@ class FaceBasedVideoCutter(QWidget):
         
         fps = cap.get(cv2.CAP_PROP_FPS)
         frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.video_fps = fps
         duration = frame_count / fps
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
@@ -339,11 +2994,16 @@ class FaceBasedVideoCutter(QWidget):
         self.detect_button.setEnabled(True)
         self.cut_button.setEnabled(False)
         
-        self.all_faces = []
-        self.face_encodings = []
-        self.face_frames = []
+        self.detections = DetectionTable()
+        self.thumbnails.clear()
         self.unique_faces = []
+        self.stop_regrouping()
+        self.regroup_merge = None
+        self.grouped_tolerance = None
         self.selected_persons.clear()
+        self.stop_preview()
+        self.timeline = None
+        self.update_timeline()
         
         self.clear_face_display()
     
@@ -355,46 +3015,223 @@ class FaceBasedVideoCutter(QWidget):
         if not self.video_path:
             return
         
+        self.stop_preview()
         self.set_buttons_state(False)
         self.cancel_button.setEnabled(True)
 
-        sample_interval = self.sample_interval_slider.value()
+        sample_interval, analyses_per_second = self.sampling_settings()
+        self.profiler = Profiler() if self.profile_checkbox.isChecked() else None
         
         self.log_status(f"Starting face detection with tolerance {self.face_tolerance:.1f}...")
         self.clear_face_display()
+        self.stop_regrouping()
+        self.regroup_merge = None
         
         self.detection_thread = FaceDetectionThread(
             self.video_path, 
-            face_tolerance=self.face_tolerance,
-            sample_interval=sample_interval
+            sample_interval=sample_interval,
+            analyses_per_second=analyses_per_second,
+            workers=self.workers_spin.value(),
+            reference=self.reference_gallery,
+            **self.detection_options()
         )
         self.detection_thread.progress_update.connect(self.update_detection_progress)
         self.detection_thread.detection_finished.connect(self.process_detection_results)
         self.detection_thread.start()
     
-    def update_detection_progress(self, value):
-        self.log_status(f"Analyzing video... {value}%")
+    def detection_options(self):
+        pixel_budget, target_face_size = self.resolution_combo.currentData()
+        return dict(
+            face_tolerance=self.face_tolerance,
+            merge_clusters=self.merge_checkbox.isChecked(),
+            tracking=self.tracking_checkbox.isChecked(),
+            motion_gating=self.gating_checkbox.isChecked(),
+            pixel_budget=pixel_budget,
+            target_face_size=target_face_size,
+            roi_detection=self.roi_checkbox.isChecked(),
+            cache=self.encoding_cache if self.cache_checkbox.isChecked() else None,
+            min_face_size=self.min_face_spin.value(),
+            profiler=self.profiler,
+            backend=make_backend(self.detector_combo.currentData(), self.yunet_model),
+            batch_size=self.batch_size_spin.value()
+        )
+
+    def update_detector(self):
+        if self.detector_combo.currentData() != "yunet" or self.yunet_model:
+            return
+        # OpenCV does not ship the YuNet weights, so the model file is picked once
+        file_path, _ = QFileDialog.getOpenFileName(self, "Select YuNet Model", "", "ONNX models (*.onnx)")
+        if file_path:
+            self.yunet_model = file_path
+            self.log_status(f"YuNet model: {os.path.basename(file_path)}")
+        else:
+            self.detector_combo.setCurrentIndex(0)
+
+    def index_people(self, register=True):
+        # Numbers people after the shared person index. Only complete detection
+        # passes are registered; regroupings just look their people up.
+        if not self.index_checkbox.isChecked() or self.reference_gallery is not None:
+            return
+        encodings = [person['encoding'] for person in self.unique_faces]
+        if register and not self.partial_detection:
+            ids = self.person_index.register(self.video_path, encodings, self.face_tolerance)
+        else:
+            ids = self.person_index.lookup(encodings, self.face_tolerance)
+        for person, person_id in zip(self.unique_faces, ids.tolist()):
+            if person_id >= 0:
+                person['person_id'] = person_id
+
+    def queue_videos(self):
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, "Select Videos", "", "Videos (*.mp4 *.avi *.mov *.mkv)"
+        )
+        if not file_paths:
+            return
+
+        self.log_status(f"Detecting people in {len(file_paths)} videos...")
+        self.start_queue([{'video': path} for path in file_paths])
+
+    def export_across_videos(self):
+        person_ids = sorted(self.unique_faces[i]['person_id'] for i in self.selected_persons
+                            if 'person_id' in self.unique_faces[i])
+        videos = self.person_index.videos_with(person_ids)
+        if not videos:
+            QMessageBox.warning(self, "Warning", "The selected people are not in the person index.")
+            return
+
+        output_dir = QFileDialog.getExistingDirectory(self, "Export Folder")
+        if not output_dir:
+            return
+
+        selected_format = self.format_combo.currentText()
+        suffix = "_".join(f"person{person_id + 1}" for person_id in person_ids)
+        jobs = [{
+            'video': video,
+            'persons': [person_id + 1 for person_id in person_ids],
+            'output': os.path.join(output_dir, f"{os.path.splitext(os.path.basename(video))[0]}_{suffix}{selected_format}")
+        } for video in videos]
+        self.log_status(f"Exporting {len(person_ids)} people from {len(videos)} videos...")
+        self.start_queue(jobs, {
+            'codec': self.codec_combo.currentData(),
+            'frame_accurate': self.frame_accurate_checkbox.isChecked(),
+            'padding': self.padding_spin.value(),
+            'merge_gap': self.merge_gap_spin.value()
+        })
+
+    def start_queue(self, jobs, export_options=None):
+        self.set_buttons_state(False)
+        self.cancel_button.setEnabled(True)
+        self.profiler = Profiler() if self.profile_checkbox.isChecked() else None
+
+        value = self.sample_interval_slider.value()
+        time_sampling = self.sampling_mode_combo.currentData() == "time"
+        options = self.detection_options()
+        options['sample_interval'] = 1 if time_sampling else value
+        options['analyses_per_second'] = value if time_sampling else None
+
+        self.queue_thread = DetectionQueueThread(jobs, self.workers_spin.value(), detector_options=options,
+                                                 export_options=export_options, person_index=self.person_index)
+        self.queue_thread.progress_update.connect(self.update_queue_progress)
+        self.queue_thread.video_finished.connect(self.report_queued_video)
+        self.queue_thread.queue_finished.connect(self.finish_queue)
+        self.queue_thread.start()
+
+    def update_queue_progress(self, snapshot):
+        self.progress_label.setText(f"Processing videos... {format_progress(snapshot)}")
+
+    def report_queued_video(self, job, summary):
+        name = os.path.basename(job['video'])
+        if summary is None:
+            self.log_status(f"{name}: could not be opened")
+        elif job.get('output'):
+            self.log_status(f"{name}: {'export failed' if summary['failed'] else 'exported'}")
+        else:
+            people = ", ".join(f"Person {person_id + 1}" for person_id in summary['people'] if person_id is not None)
+            self.log_status(f"{name}: {people or 'nobody found'}")
+
+    def finish_queue(self, failures):
+        self.set_buttons_state(True)
+        self.log_status(f"All queued videos processed ({failures} failed). "
+                        f"The person index now holds {len(self.person_index)} people.")
+
+    def load_reference(self):
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, "Select Reference Photos or Encodings", "", "Faces (*.jpg *.jpeg *.png *.bmp *.npy)"
+        )
+        if not file_paths:
+            return
+
+        try:
+            self.reference_gallery = ReferenceGallery.from_files(file_paths)
+        except (OSError, ValueError) as error:
+            QMessageBox.critical(self, "Error", f"Could not load the reference: {error}")
+            return
+
+        self.reference_label.setText(f"Reference: {len(self.reference_gallery.encodings)} faces from "
+                                     f"{len(file_paths)} files. Only this person will be detected.")
+        self.clear_reference_button.setEnabled(True)
+        self.log_status("Reference faces loaded.")
+
+    def clear_reference(self):
+        self.reference_gallery = None
+        self.reference_label.setText("No reference: all people are grouped automatically")
+        self.clear_reference_button.setEnabled(False)
+
+    def update_detection_progress(self, snapshot):
+        self.progress_label.setText(f"Analyzing video... {format_progress(snapshot)}")
     
-    def process_detection_results(self, all_faces, face_encodings, face_frames, unique_faces, total_frames):
-        self.all_faces = all_faces
-        self.face_encodings = face_encodings
-        self.face_frames = face_frames
+    def process_detection_results(self, detections, unique_faces, total_frames, thumbnails, stats):
+        self.detections = detections
+        self.thumbnails.clear()
+        self.thumbnails.update(thumbnails)
         self.unique_faces = unique_faces
+        # Regrouping replays this pass, so it keeps the options it was detected with
+        detector = self.detection_thread.detector
+        self.regroup_merge = detector.merge_clusters if detector.reference is None else None
+        self.grouped_tolerance = detector.face_tolerance
+        # Each analysed frame stands for the frames up to the next one of this pass
+        self.detection_step = sampling_step(self.video_fps, detector.sample_interval, detector.analyses_per_second)
+        if self.regroup_merge is not None:
+            self.start_regrouping()
+        self.total_frames = total_frames
+        self.selected_persons.clear()
+        self.partial_detection = stats['partial']
+        self.index_people()
+        self.build_timeline()
         
         self.set_buttons_state(True)
         self.cancel_button.setEnabled(False)
         self.cut_button.setEnabled(False)
         
+        if stats['resumed_from']:
+            self.log_status(f"Resumed the interrupted detection pass from frame {stats['resumed_from']}")
+        if stats['partial']:
+            self.log_status(f"Detection stopped at frame {stats['last_frame'] + 1} of {total_frames}; "
+                            f"the people found so far can be previewed and exported. "
+                            f"Detect again with the same settings to continue")
+        if not stats['cached']:
+            self.log_status(f"Analysed {stats['frames_analysed']} of {stats['frames_sampled']} sampled frames "
+                            f"({stats['frames_inherited']} unchanged frames skipped, {stats['scene_cuts']} shot changes)")
+            self.log_status(f"{stats['encodings_computed']} face encodings computed, "
+                            f"{stats['encodings_reused']} reused from tracked faces")
+            if stats['region_scans']:
+                self.log_status(f"{stats['region_scans']} analyses searched only around known faces")
         self.log_status(f"{len(unique_faces)} people found with tolerance {self.face_tolerance:.1f}! Select one or more:")
-        self.detection_info.setText(f"Total Frames: {total_frames} | "
-                                   f"Frames with Faces: {len(set(self.face_frames))} | "
-                                   f"Total Faces: {len(self.all_faces)} | "
-                                   f"People: {len(self.unique_faces)}")
+        self.update_detection_info()
         
         self.display_unique_faces()
+
+    def update_detection_info(self):
+        self.detection_info.setText(f"Total Frames: {self.total_frames} | "
+                                   f"Frames with Faces: {len(np.unique(self.detections.frame_indices))} | "
+                                   f"Total Faces: {len(self.detections)} | "
+                                   f"People: {len(self.unique_faces)}")
     
     def display_unique_faces(self):
         self.clear_face_display()
+
+        missing = [person['face_index'] for person in self.unique_faces if person['face_index'] not in self.thumbnails]
+        self.thumbnails.update(load_thumbnails(self.video_path, self.detections, missing))
         
         cols = 4
         for i, person in enumerate(self.unique_faces):
@@ -404,19 +3241,24 @@ class FaceBasedVideoCutter(QWidget):
             person_widget = QWidget()
             person_layout = QVBoxLayout()
             
-            face_img = cv2.cvtColor(person['face_img'], cv2.COLOR_BGR2RGB)
-            h, w, ch = face_img.shape
-            bytes_per_line = ch * w
-            q_image = QImage(face_img.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
-            
-            pixmap = QPixmap.fromImage(q_image).scaled(150, 150, Qt.AspectRatioMode.KeepAspectRatio)
-            
             img_label = QLabel()
-            img_label.setPixmap(pixmap)
+            thumbnail = self.thumbnails.get(person['face_index'])
+            if thumbnail is not None:
+                face_img = cv2.cvtColor(thumbnail, cv2.COLOR_BGR2RGB)
+                h, w, ch = face_img.shape
+                bytes_per_line = ch * w
+                q_image = QImage(face_img.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
+                
+                pixmap = QPixmap.fromImage(q_image).scaled(150, 150, Qt.AspectRatioMode.KeepAspectRatio)
+                img_label.setPixmap(pixmap)
             img_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
             
-            checkbox = QCheckBox(f"Person {i+1} ({len(person['indices'])} appearances)")
+            number = person['person_id'] + 1 if 'person_id' in person else i + 1
+            checkbox = QCheckBox(f"Person {number} ({len(person['indices'])} appearances)")
             checkbox.stateChanged.connect(lambda state, idx=i: self.update_selection(idx, state))
+            if self.regroup_merge is None:
+                # Reference mode finds a single target, so it is selected right away
+                checkbox.setChecked(True)
             
             person_layout.addWidget(img_label)
             person_layout.addWidget(checkbox)
@@ -431,6 +3273,10 @@ class FaceBasedVideoCutter(QWidget):
             self.selected_persons.discard(index)
         
         self.log_status(f"{len(self.selected_persons)} people selected")
+        self.export_across_button.setEnabled(
+            any('person_id' in self.unique_faces[i] for i in self.selected_persons)
+        )
+        self.update_timeline()
         
         self.cut_button.setEnabled(len(self.selected_persons) > 0)
 
@@ -459,6 +3305,11 @@ class FaceBasedVideoCutter(QWidget):
         
         return True, ""
     
+    def update_export_mode(self):
+        copy_mode = self.codec_combo.currentData() == "copy"
+        self.frame_accurate_checkbox.setEnabled(copy_mode)
+        self.export_workers_spin.setEnabled(not copy_mode)
+
     def cut_video(self):
         if not self.video_path or not self.selected_persons:
             QMessageBox.warning(self, "Warning", "Select at least one person to cut the video.")
@@ -467,6 +3318,14 @@ class FaceBasedVideoCutter(QWidget):
         selected_codec = self.codec_combo.currentData()
         selected_format = self.format_combo.currentText()
 
+        if not len(self.selected_segments()):
+            QMessageBox.warning(self, "Warning", "The selected people never appear together.")
+            return
+
+        if selected_codec == "copy" and not ffmpeg_available():
+            QMessageBox.warning(self, "Warning", "Copy mode needs ffmpeg and ffprobe installed and on the PATH.")
+            return
+
         is_compatible, error_message = self.validate_codec_format_compatibility(selected_codec, selected_format)
     
         if not is_compatible:
@@ -492,26 +3351,123 @@ class FaceBasedVideoCutter(QWidget):
         
         self.set_buttons_state(False)
         
-        selected_indices = set()
-        for person_idx in self.selected_persons:
-            selected_indices.update(self.unique_faces[person_idx]['indices'])
-        
-        selected_frames = set([self.face_frames[idx] for idx in selected_indices])
-        
         selected_codec = self.codec_combo.currentData()
-        sample_interval = self.sample_interval_slider.value()
+        frame_ranges = self.selected_segments().padded(self.padding_spin.value(), self.merge_gap_spin.value(),
+                                                       self.total_frames).ranges()
         
-        self.log_status("Starting video processing and export...")
-        self.writer_thread = VideoWriterThread(self.video_path, output_path, selected_frames, selected_codec, sample_interval)
+        self.log_status(f"Starting video processing and export of {len(frame_ranges)} segments...")
+        # Export timings join those of the detection run when both are profiled
+        if self.profile_checkbox.isChecked() and self.profiler is None:
+            self.profiler = Profiler()
+        self.writer_thread = VideoWriterThread(self.video_path, output_path, frame_ranges, selected_codec,
+                                               self.frame_accurate_checkbox.isChecked(),
+                                               self.export_workers_spin.value(),
+                                               self.profiler if self.profile_checkbox.isChecked() else None)
         self.writer_thread.progress_update.connect(self.update_cutting_progress)
         self.writer_thread.cutting_finished.connect(self.finish_cutting)
         self.writer_thread.start()
     
-    def update_cutting_progress(self, value):
-        self.log_status(f"Processing video... {value}%")
+    def build_timeline(self):
+        self.timeline = PersonTimeline(self.detections, self.unique_faces, self.detection_step, self.total_frames)
+        self.update_timeline()
+
+    def selected_segments(self):
+        if self.timeline is None or not self.selected_persons:
+            return SegmentList()
+        return self.timeline.select(self.selected_persons, self.together_checkbox.isChecked())
+
+    def update_timeline(self):
+        rows = []
+        if self.timeline is not None:
+            for row, index in enumerate(sorted(self.selected_persons)):
+                person = self.unique_faces[index]
+                number = person['person_id'] + 1 if 'person_id' in person else index + 1
+                rows.append((f"Person {number}", self.timeline.person(index),
+                             TIMELINE_COLORS[row % len(TIMELINE_COLORS)]))
+        segments = self.selected_segments()
+        if len(rows) > 1:
+            label = "All together" if self.together_checkbox.isChecked() else "Any of them"
+            rows.append((label, segments, (230, 230, 230)))
+        self.timeline_widget.set_rows(rows, self.total_frames)
+
+        if rows:
+            seconds = segments.frame_count() / self.video_fps if self.video_fps else 0
+            self.timeline_info.setText(f"{len(segments)} segments, {seconds:.1f} s of video")
+        else:
+            self.timeline_info.setText("Select people to see their segments")
+        self.preview_button.setEnabled(len(segments) > 0)
+
+        if self.preview_timer.isActive():
+            if len(segments):
+                self.preview_segments = segments
+            else:
+                self.stop_preview()
+
+    def toggle_preview(self):
+        if self.preview_timer.isActive():
+            self.stop_preview()
+            return
+
+        segments = self.selected_segments()
+        if not len(segments):
+            return
+        self.preview_cap = cv2.VideoCapture(self.video_path)
+        self.preview_segments = segments
+        self.preview_position = 0
+        self.preview_frame = int(segments.starts[0])
+        self.preview_label.show()
+        self.preview_button.setText("Stop Preview")
+        self.preview_timer.start(max(1, int(1000 / (self.video_fps or 25))))
+
+    def seek_preview(self, frame):
+        if not self.preview_timer.isActive():
+            self.toggle_preview()
+        self.preview_frame = frame
+
+    def show_preview_frame(self):
+        # Plays the selected segments only; the gaps between them are crossed by seeking
+        segments = self.preview_segments
+        index = segments.find(self.preview_frame)
+        if index >= len(segments):
+            self.stop_preview()
+            return
+
+        target = max(self.preview_frame, int(segments.starts[index]))
+        self.preview_position = advance_to(self.preview_cap, self.preview_position, target)
+        ret, frame = self.preview_cap.read()
+        if not ret:
+            self.stop_preview()
+            return
+        self.preview_position += 1
+        self.preview_frame = target + 1
+
+        height, width = frame.shape[:2]
+        preview_size = (PREVIEW_WIDTH, max(1, int(height * PREVIEW_WIDTH / width)))
+        rgb_frame = cv2.cvtColor(cv2.resize(frame, preview_size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+        image = QImage(rgb_frame.data, preview_size[0], preview_size[1], 3 * preview_size[0],
+                       QImage.Format.Format_RGB888)
+        self.preview_label.setPixmap(QPixmap.fromImage(image))
+        self.timeline_widget.set_position(target)
+
+    def stop_preview(self):
+        self.preview_timer.stop()
+        if self.preview_cap is not None:
+            self.preview_cap.release()
+            self.preview_cap = None
+        self.preview_label.hide()
+        self.preview_button.setText("Preview Segments")
+        self.timeline_widget.set_position(None)
+
+    def update_cutting_progress(self, snapshot):
+        self.progress_label.setText(f"Processing video... {format_progress(snapshot)}")
     
     def finish_cutting(self, used_codec):
         self.set_buttons_state(True)
+
+        if used_codec == "Failed":
+            self.log_status("Video export failed.")
+            QMessageBox.critical(self, "Error", "The video could not be exported.")
+            return
         
         self.log_status(f"Video processed and exported successfully using codec {used_codec}!")
         
@@ -530,6 +3486,10 @@ class FaceBasedVideoCutter(QWidget):
             self.writer_thread.stop()
             self.writer_thread.wait()
             self.log_status("Video processing canceled.")
+        elif self.queue_thread and self.queue_thread.isRunning():
+            self.queue_thread.stop()
+            self.queue_thread.wait()
+            self.log_status("Video queue canceled.")
             
         self.set_buttons_state(True)
         if self.video_path:
@@ -544,6 +3504,44 @@ class FaceBasedVideoCutter(QWidget):
         self.cancel_button.setEnabled(False)
         self.tolerance_slider.setEnabled(enabled)
         self.sample_interval_slider.setEnabled(enabled)
+        self.sampling_mode_combo.setEnabled(enabled)
+        self.workers_spin.setEnabled(enabled)
+        self.merge_checkbox.setEnabled(enabled)
+        self.tracking_checkbox.setEnabled(enabled)
+        self.gating_checkbox.setEnabled(enabled)
+        self.resolution_combo.setEnabled(enabled)
+        self.roi_checkbox.setEnabled(enabled)
+        self.detector_combo.setEnabled(enabled)
+        self.batch_size_spin.setEnabled(enabled)
+        self.cache_checkbox.setEnabled(enabled)
+        self.index_checkbox.setEnabled(enabled)
+        self.queue_button.setEnabled(enabled)
+        self.export_across_button.setEnabled(enabled and any('person_id' in self.unique_faces[i]
+                                                             for i in self.selected_persons))
+        self.min_face_spin.setEnabled(enabled)
+        self.reference_button.setEnabled(enabled)
+        self.clear_reference_button.setEnabled(enabled and self.reference_gallery is not None)
+        self.profile_checkbox.setEnabled(enabled)
+        self.profile_button.setEnabled(enabled and self.profiler is not None)
+    
+    def show_profile(self):
+        if self.profiler is None:
+            return
+
+        dialog = QMessageBox(self)
+        dialog.setWindowTitle("Profile")
+        dialog.setText(format_profile(self.profiler.summary()))
+        save_button = dialog.addButton("Save Trace...", QMessageBox.ButtonRole.ActionRole)
+        dialog.addButton(QMessageBox.StandardButton.Close)
+        dialog.exec()
+        if dialog.clickedButton() != save_button:
+            return
+
+        path, _ = QFileDialog.getSaveFileName(self, "Save Profiling Trace", "profile.json",
+                                              "JSON (*.json);;CSV (*.csv)")
+        if path:
+            self.profiler.write(path)
+            self.log_status(f"Profiling trace saved to {path}")
     
     def log_status(self, message):
         self.status_log.append(f"Status: {message}")
@@ -552,7 +3550,547 @@ class FaceBasedVideoCutter(QWidget):
         )
 
 
+CLI_COMMANDS = ("detect", "people", "export", "match", "batch", "index", "export-person", "benchmark")
+
+
+def cli_progress(label):
+    # The status line is rewritten in place; \033[K clears what is left of a longer previous line
+    def show(snapshot):
+        print(f"\r{label}: {format_progress(snapshot)}\033[K", end="", file=sys.stderr, flush=True)
+    return ProgressReporter(show).update
+
+
+def add_detection_arguments(parser):
+    parser.add_argument("--tolerance", type=float, default=0.7, help="similarity tolerance (default: 0.7)")
+    sampling = parser.add_mutually_exclusive_group()
+    sampling.add_argument("--sample-interval", type=int, default=1, help="analyse one frame in every N")
+    sampling.add_argument("--per-second", type=int, help="analyse N frames per second of video")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="detection processes")
+    resolution = parser.add_mutually_exclusive_group()
+    resolution.add_argument("--downscale", type=float, help="fixed detection resolution factor")
+    resolution.add_argument("--pixel-budget", type=int, default=DEFAULT_PIXEL_BUDGET,
+                            help=f"scale frames to about N pixels for detection (default: {DEFAULT_PIXEL_BUDGET})")
+    resolution.add_argument("--target-face-size", type=int,
+                            help="scale frames just enough to find faces of N source pixels")
+    parser.add_argument("--detector", default="hog", choices=DETECTION_BACKENDS, help="face detector (default: hog)")
+    parser.add_argument("--yunet-model", help="face_detection_yunet .onnx model file for --detector yunet")
+    parser.add_argument("--batch-size", type=int, default=4,
+                        help="analysed frames located and encoded together (default: 4)")
+    parser.add_argument("--roi", action="store_true", help="search only around the faces found last")
+    parser.add_argument("--full-scan-interval", type=int, default=10,
+                        help="in ROI mode, scan the full frame every N analyses (default: 10)")
+    parser.add_argument("--no-merge", action="store_true", help="do not merge similar people")
+    parser.add_argument("--no-tracking", action="store_true", help="encode every face instead of tracking them")
+    parser.add_argument("--track-refresh", type=int, default=25,
+                        help="re-encode tracked faces every N analysed frames (default: 25)")
+    parser.add_argument("--no-gating", action="store_true", help="analyse every sampled frame, even unchanged ones")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="detection cache directory")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the detection cache")
+    parser.add_argument("--min-face-size", type=int, default=0, help="skip faces smaller than N source pixels")
+    parser.add_argument("--profile", metavar="PATH", help="write per-stage timings to this .json or .csv file")
+
+
+def add_export_arguments(parser, workers=True):
+    parser.add_argument("--codec", default="avc1", choices=[codec for _, codec in EXPORT_CODECS])
+    parser.add_argument("--padding", type=int, default=0, help="frames added around each segment")
+    parser.add_argument("--merge-gap", type=int, default=0, help="merge segments closer than N frames")
+    parser.add_argument("--frame-accurate", action="store_true", help="frame-accurate cuts in copy mode")
+    if workers:
+        parser.add_argument("--export-workers", type=int, default=os.cpu_count() or 1, help="export processes")
+
+
+def add_queue_arguments(parser):
+    parser.add_argument("--jobs", type=int, default=2, help="videos processed at the same time (default: 2)")
+    parser.add_argument("--index-dir", default=DEFAULT_PERSON_INDEX_DIR, help="person index directory")
+
+
+def detector_options(args):
+    return dict(
+        face_tolerance=args.tolerance,
+        sample_interval=args.sample_interval,
+        analyses_per_second=args.per_second,
+        merge_clusters=not args.no_merge,
+        tracking=not args.no_tracking,
+        track_refresh=args.track_refresh,
+        motion_gating=not args.no_gating,
+        downscale=args.downscale,
+        pixel_budget=args.pixel_budget,
+        target_face_size=args.target_face_size,
+        roi_detection=args.roi,
+        full_scan_interval=args.full_scan_interval,
+        profiler=args.profiler,
+        cache=None if args.no_cache else EncodingCache(args.cache_dir),
+        min_face_size=args.min_face_size,
+        backend=make_backend(args.detector, args.yunet_model),
+        batch_size=args.batch_size
+    )
+
+
+def run_cli_detection(video_path, args, reference=None):
+    detector = FaceDetector(video_path, workers=args.workers, reference=reference,
+                            progress_callback=cli_progress(f"Detecting {os.path.basename(video_path)}"),
+                            **detector_options(args))
+    result = detector.run()
+    print(file=sys.stderr)
+    if result is None:
+        print(f"Error: could not open {video_path}", file=sys.stderr)
+    elif not result['stats']['cached']:
+        stats = result['stats']
+        if stats['resumed_from']:
+            print(f"Resumed the interrupted pass from frame {stats['resumed_from']}", file=sys.stderr)
+        print(f"Analysed {stats['frames_analysed']} of {stats['frames_sampled']} sampled frames "
+              f"({stats['frames_inherited']} unchanged, {stats['scene_cuts']} shot changes); "
+              f"{stats['encodings_computed']} encodings computed, {stats['encodings_reused']} reused",
+              file=sys.stderr)
+    return result
+
+
+def print_people(result):
+    detections = result['detections']
+    print(f"Total Frames: {result['total_frames']} | Total Faces: {len(detections)} | "
+          f"People: {len(result['unique_faces'])}")
+    for i, person in enumerate(result['unique_faces']):
+        frames = detections.frame_indices[person['indices']]
+        print(f"Person {i + 1}: {len(person['indices'])} appearances, frames {frames.min()}-{frames.max()}")
+
+
+def export_people(video_path, output_path, result, persons, args):
+    person_indices = [person - 1 for person in persons]
+    if any(not 0 <= idx < len(result['unique_faces']) for idx in person_indices):
+        print(f"Error: person IDs must be between 1 and {len(result['unique_faces'])}", file=sys.stderr)
+        return False
+
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+
+    sample_interval = sampling_step(fps, args.sample_interval, args.per_second)
+    timeline = PersonTimeline(result['detections'], result['unique_faces'], sample_interval, result['total_frames'])
+    segments = timeline.select(person_indices, getattr(args, "together", False))
+    if not len(segments):
+        print("The selected people never appear together.", file=sys.stderr)
+        return False
+    frame_ranges = segments.padded(args.padding, args.merge_gap, result['total_frames']).ranges()
+    completed = export_video(video_path, output_path, frame_ranges, args.codec, args.frame_accurate,
+                             args.export_workers, cli_progress(f"Exporting {os.path.basename(output_path)}"),
+                             profiler=args.profiler)
+    print(file=sys.stderr)
+    if not completed:
+        print(f"Error: could not export {output_path}", file=sys.stderr)
+    return completed
+
+
+def detect_command(args):
+    result = run_cli_detection(args.video, args)
+    if result is None:
+        return 1
+
+    if args.output:
+        labels = np.zeros(len(result['detections']), dtype=np.int32)
+        for i, person in enumerate(result['unique_faces']):
+            labels[person['indices']] = i + 1
+        np.savez(args.output, frame_indices=result['detections'].frame_indices,
+                 boxes=result['detections'].boxes, encodings=result['detections'].encodings,
+                 person_ids=labels)
+    print_people(result)
+    return 0
+
+
+def people_command(args):
+    result = run_cli_detection(args.video, args)
+    if result is None:
+        return 1
+
+    print_people(result)
+    if args.thumbnails:
+        os.makedirs(args.thumbnails, exist_ok=True)
+        face_indices = [person['face_index'] for person in result['unique_faces']]
+        thumbnails = dict(result['thumbnails'])
+        missing = [index for index in face_indices if index not in thumbnails]
+        thumbnails.update(load_thumbnails(args.video, result['detections'], missing))
+        for i, index in enumerate(face_indices):
+            if thumbnails.get(index) is not None:
+                cv2.imwrite(os.path.join(args.thumbnails, f"person_{i + 1}.jpg"), thumbnails[index])
+    return 0
+
+
+def export_command(args):
+    result = run_cli_detection(args.video, args)
+    if result is None:
+        return 1
+    return 0 if export_people(args.video, args.output, result, args.person, args) else 1
+
+
+def load_cli_reference(paths):
+    # None when the reference files cannot be read, after saying why
+    try:
+        return ReferenceGallery.from_files(paths)
+    except (OSError, ValueError) as error:
+        print(f"Error: could not load the reference: {error}", file=sys.stderr)
+        return None
+
+
+def match_command(args):
+    reference = load_cli_reference(args.reference)
+    if reference is None:
+        return 1
+    result = run_cli_detection(args.video, args, reference)
+    if result is None:
+        return 1
+    if not result['unique_faces']:
+        print("The reference person was not found.", file=sys.stderr)
+        return 1
+    return 0 if export_people(args.video, args.output, result, [1], args) else 1
+
+
+def list_videos(directory):
+    return [
+        os.path.join(directory, name) for name in sorted(os.listdir(directory))
+        if os.path.splitext(name)[1].lower() in VIDEO_FORMATS
+    ]
+
+
+def batch_jobs(source, output_dir, output_format):
+    if os.path.isdir(source):
+        jobs = [{'video': video} for video in list_videos(source)]
+    else:
+        # A manifest is a JSON list of {"video": ..., "persons": [...], "output": ...}
+        with open(source) as f:
+            jobs = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(source))
+        for job in jobs:
+            job['video'] = os.path.join(base_dir, job['video'])
+
+    for job in jobs:
+        if not job.get('output'):
+            name = os.path.splitext(os.path.basename(job['video']))[0]
+            job['output'] = os.path.join(output_dir, f"{name}_cut{output_format}")
+    return jobs
+
+
+def batch_command(args):
+    reference = None
+    if args.reference:
+        reference = load_cli_reference(args.reference)
+        if reference is None:
+            return 1
+    os.makedirs(args.output_dir, exist_ok=True)
+    failures = 0
+    for job in batch_jobs(args.source, args.output_dir, args.format):
+        result = run_cli_detection(job['video'], args, reference)
+        if result is None:
+            failures += 1
+            continue
+
+        print(f"== {job['video']}")
+        print_people(result)
+        # With a reference the target is exported straight away, without picking people
+        persons = [1] if reference is not None and result['unique_faces'] else job.get('persons')
+        if persons and not export_people(job['video'], job['output'], result, persons, args):
+            failures += 1
+    return 1 if failures else 0
+
+
+def print_index(person_index):
+    print(f"Person index: {len(person_index)} people in {len(person_index.videos)} videos")
+    for person_id in range(len(person_index)):
+        videos = person_index.videos_with([person_id])
+        print(f"Person {person_id + 1}: " + ", ".join(os.path.basename(video) for video in videos))
+
+
+def print_queued_job(job, result):
+    print(file=sys.stderr)
+    if result is None:
+        print(f"Error: could not open {job['video']}", file=sys.stderr)
+    elif job.get('output'):
+        status = "failed" if result.get('failed') else ("exported" if result['unique_faces'] else "person not found")
+        print(f"{job['video']}: {status}")
+    else:
+        people = ", ".join(f"Person {person['person_id'] + 1}" for person in result['unique_faces']
+                           if 'person_id' in person)
+        print(f"{job['video']}: {people or 'nobody found'}")
+
+
+def index_command(args):
+    person_index = PersonIndex(args.index_dir)
+    videos = []
+    for source in args.videos:
+        videos.extend(list_videos(source) if os.path.isdir(source) else [source])
+
+    failures = DetectionQueue(
+        [{'video': video} for video in videos], args.workers, args.jobs, detector_options(args),
+        person_index=person_index, progress_callback=cli_progress("Indexing"), job_callback=print_queued_job
+    ).run()
+    print_index(person_index)
+    return 1 if failures else 0
+
+
+def export_person_command(args):
+    person_index = PersonIndex(args.index_dir)
+    if any(not 1 <= person <= len(person_index) for person in args.person):
+        print(f"Error: person IDs must be between 1 and {len(person_index)}", file=sys.stderr)
+        return 1
+
+    videos = person_index.videos_with([person - 1 for person in args.person])
+    if not videos:
+        print("The person was not found in any indexed video.", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    suffix = "_".join(f"person{person}" for person in sorted(args.person))
+    jobs = [{
+        'video': video,
+        'persons': args.person,
+        'output': os.path.join(args.output_dir, f"{os.path.splitext(os.path.basename(video))[0]}_{suffix}{args.format}")
+    } for video in videos]
+    export_options = {'codec': args.codec, 'frame_accurate': args.frame_accurate,
+                      'padding': args.padding, 'merge_gap': args.merge_gap}
+    failures = DetectionQueue(
+        jobs, args.workers, args.jobs, detector_options(args), export_options, person_index,
+        progress_callback=cli_progress("Exporting"), job_callback=print_queued_job
+    ).run()
+    return 1 if failures else 0
+
+
+# Synthetic clips: (name, (width, height), frames, faces)
+BENCHMARK_VIDEOS = [
+    ("360p-1face", (640, 360), 150, 1),
+    ("720p-2faces", (1280, 720), 150, 2),
+    ("1080p-3faces", (1920, 1080), 150, 3),
+]
+# (name, FaceDetector options, export codec)
+BENCHMARK_CONFIGS = [
+    ("default", {}, "MJPG"),
+    ("every-5th-frame", {'sample_interval': 5}, "MJPG"),
+    ("quarter-scale", {'downscale': 0.25}, "MJPG"),
+    ("no-tracking-no-gating", {'tracking': False, 'motion_gating': False}, "MJPG"),
+    ("unbatched", {'batch_size': 1}, "MJPG"),
+    ("roi", {'roi_detection': True}, "mp4v"),
+]
+
+
+def draw_synthetic_face(frame, center, size, skin):
+    x, y = center
+    cv2.ellipse(frame, (x, y), (size // 2, int(size * 0.65)), 0, 0, 360, skin, -1)
+    eye_radius = max(2, size // 14)
+    for eye_x in (x - size // 5, x + size // 5):
+        cv2.circle(frame, (eye_x, y - size // 6), eye_radius, (40, 40, 40), -1)
+    cv2.line(frame, (x, y - size // 20), (x, y + size // 8), (90, 100, 150), max(1, size // 30))
+    cv2.ellipse(frame, (x, y + size // 4), (size // 5, size // 12), 0, 0, 180, (60, 60, 150), max(1, size // 25))
+
+
+def make_synthetic_video(path, size, frame_count, faces, fps=25, seed=0):
+    # Faces drift along their own paths over a gradient background that changes
+    # halfway through, so both static stretches and a shot change are present
+    width, height = size
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    gradient = np.linspace(0, 1, width, dtype=np.float32)[None, :, None]
+    backgrounds = [
+        (gradient * np.array(colors, dtype=np.float32)).astype(np.uint8).repeat(height, axis=0)
+        for colors in ((120, 160, 200), (200, 120, 90))
+    ]
+    face_size = max(40, height // 5)
+    paths = rng.uniform(0.2, 0.8, size=(faces, 2)), rng.uniform(0.005, 0.02, size=(faces, 2))
+    skins = [tuple(int(c) for c in rng.integers(120, 230, size=3)) for _ in range(faces)]
+
+    for index in range(frame_count):
+        frame = backgrounds[index * 2 // frame_count].copy()
+        for (start_x, start_y), (speed_x, speed_y), skin in zip(paths[0], paths[1], skins):
+            x = int(width * (0.5 + (start_x - 0.5) * np.cos(index * speed_x * 2 * np.pi)))
+            y = int(height * (0.5 + (start_y - 0.5) * np.sin(index * speed_y * 2 * np.pi)))
+            draw_synthetic_face(frame, (x, y), face_size, skin)
+        writer.write(frame)
+    writer.release()
+
+
+def run_benchmark(video_path, options, codec, workers, export_workers, output_dir):
+    profiler = Profiler()
+    detector = FaceDetector(video_path, workers=workers, profiler=profiler,
+                            progress_callback=cli_progress(f"Detecting {os.path.basename(video_path)}"), **options)
+    started = time.perf_counter()
+    result = detector.run()
+    detect_seconds = time.perf_counter() - started
+    print(file=sys.stderr)
+    if result is None:
+        return None
+
+    # Regrouping cost, as when the tolerance slider moves after detection
+    started = time.perf_counter()
+    Regrouper(result['detections'].frame_indices, result['detections'].encodings).cut(0.5)
+    cluster_seconds = time.perf_counter() - started
+
+    total_frames = result['total_frames']
+    unique_faces = result['unique_faces']
+    timeline = PersonTimeline(result['detections'], unique_faces, options.get('sample_interval', 1), total_frames)
+    segments = timeline.select(range(len(unique_faces)))
+    frame_ranges = segments.ranges() if len(segments) else [(0, total_frames - 1)]
+    exported_frames = sum(end - start + 1 for start, end in frame_ranges)
+    started = time.perf_counter()
+    exported = export_video(video_path, os.path.join(output_dir, "benchmark_export.avi"), frame_ranges, codec,
+                            workers=export_workers,
+                            progress_callback=cli_progress(f"Exporting with {codec}"), profiler=profiler)
+    export_seconds = time.perf_counter() - started
+    print(file=sys.stderr)
+
+    return {
+        'detect_seconds': round(detect_seconds, 3),
+        'detect_fps': round(total_frames / detect_seconds, 1) if detect_seconds else None,
+        'cluster_seconds': round(cluster_seconds, 3),
+        'export_seconds': round(export_seconds, 3),
+        'export_fps': round(exported_frames / export_seconds, 1) if exported and export_seconds else None,
+        'exported': exported,
+        'faces_found': len(result['detections']),
+        'people_found': len(unique_faces),
+        'stats': result['stats'],
+        'profile': profiler.summary(),
+        'peak_rss_mb': peak_rss_mb(),
+        'children_peak_rss_mb': peak_rss_mb(children=True)
+    }
+
+
+def benchmark_command(args):
+    videos = [video for video in BENCHMARK_VIDEOS if not args.video or video[0] in args.video]
+    configs = [config for config in BENCHMARK_CONFIGS if not args.config or config[0] in args.config]
+    if args.quick:
+        videos, configs = videos[:1], configs[:1]
+
+    work_dir = args.video_dir or tempfile.mkdtemp(prefix="face_cutter_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    report = {
+        'python': sys.version.split()[0],
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'workers': args.workers,
+        'export_workers': args.export_workers,
+        'results': []
+    }
+    try:
+        for name, size, frame_count, faces in videos:
+            video_path = os.path.join(work_dir, f"{name}.avi")
+            if not os.path.exists(video_path):
+                make_synthetic_video(video_path, size, frame_count, faces)
+
+            for config_name, options, codec in configs:
+                # A fresh process per run, so the peak memory is not the high-water mark of the runs before
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    measured = executor.submit(run_benchmark, video_path, options, codec, args.workers,
+                                               args.export_workers, work_dir).result()
+                if measured is None:
+                    print(f"Error: could not open {video_path}", file=sys.stderr)
+                    return 1
+                report['results'].append(dict({
+                    'video': name, 'resolution': f"{size[0]}x{size[1]}", 'frames': frame_count, 'faces': faces,
+                    'config': config_name, 'options': options, 'codec': codec
+                }, **measured))
+    finally:
+        if not args.video_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+def main_cli(argv):
+    parser = argparse.ArgumentParser(
+        prog="face_based_video_cutter.py",
+        description="Detect people in videos and export the segments where they appear, without the GUI."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    detect_parser = subparsers.add_parser("detect", help="run detection and fill the cache")
+    detect_parser.add_argument("video")
+    detect_parser.add_argument("--output", help="also write the detection table to this .npz file")
+    add_detection_arguments(detect_parser)
+    detect_parser.set_defaults(func=detect_command)
+
+    people_parser = subparsers.add_parser("people", help="list the people found in a video")
+    people_parser.add_argument("video")
+    people_parser.add_argument("--thumbnails", help="write one thumbnail per person to this directory")
+    add_detection_arguments(people_parser)
+    people_parser.set_defaults(func=people_command)
+
+    export_parser = subparsers.add_parser("export", help="export the segments of chosen people")
+    export_parser.add_argument("video")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--person", type=int, action="append", required=True,
+                               help="person ID as listed by 'people' (repeatable)")
+    export_parser.add_argument("--together", action="store_true",
+                               help="only export the stretches where all given people appear at once")
+    add_detection_arguments(export_parser)
+    add_export_arguments(export_parser)
+    export_parser.set_defaults(func=export_command)
+
+    match_parser = subparsers.add_parser("match", help="export the segments of a person given reference photos")
+    match_parser.add_argument("video")
+    match_parser.add_argument("output")
+    match_parser.add_argument("--reference", action="append", required=True,
+                              help="reference photo or .npy encoding file (repeatable)")
+    add_detection_arguments(match_parser)
+    add_export_arguments(match_parser)
+    match_parser.set_defaults(func=match_command)
+
+    batch_parser = subparsers.add_parser("batch", help="process a directory of videos or a JSON manifest")
+    batch_parser.add_argument("source", help="directory of videos or JSON manifest")
+    batch_parser.add_argument("--output-dir", default=".", help="where exported videos are written")
+    batch_parser.add_argument("--format", default=".mp4", choices=VIDEO_FORMATS)
+    batch_parser.add_argument("--together", action="store_true",
+                              help="only export the stretches where all listed people appear at once")
+    batch_parser.add_argument("--reference", action="append",
+                              help="export only this person from every video (photo or .npy, repeatable)")
+    add_detection_arguments(batch_parser)
+    add_export_arguments(batch_parser)
+    batch_parser.set_defaults(func=batch_command)
+
+    index_parser = subparsers.add_parser("index", help="detect people in many videos and match them across videos")
+    index_parser.add_argument("videos", nargs="+", help="videos or directories of videos")
+    add_detection_arguments(index_parser)
+    add_queue_arguments(index_parser)
+    index_parser.set_defaults(func=index_command)
+
+    export_person_parser = subparsers.add_parser("export-person",
+                                                 help="export indexed people from every video they appear in")
+    export_person_parser.add_argument("--person", type=int, action="append", required=True,
+                                      help="person ID as listed by 'index' (repeatable)")
+    export_person_parser.add_argument("--output-dir", default=".", help="where exported videos are written")
+    export_person_parser.add_argument("--format", default=".mp4", choices=VIDEO_FORMATS)
+    add_detection_arguments(export_person_parser)
+    add_export_arguments(export_person_parser, workers=False)
+    add_queue_arguments(export_person_parser)
+    export_person_parser.set_defaults(func=export_person_command)
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="measure detection and export speed on synthetic videos")
+    benchmark_parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    benchmark_parser.add_argument("--video-dir", help="generate and keep the test videos here (reused if present)")
+    benchmark_parser.add_argument("--video", action="append", choices=[video[0] for video in BENCHMARK_VIDEOS],
+                                  help="only this test video (repeatable)")
+    benchmark_parser.add_argument("--config", action="append", choices=[config[0] for config in BENCHMARK_CONFIGS],
+                                  help="only this configuration (repeatable)")
+    benchmark_parser.add_argument("--quick", action="store_true", help="one video and one configuration")
+    benchmark_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="detection processes")
+    benchmark_parser.add_argument("--export-workers", type=int, default=1, help="export processes")
+    benchmark_parser.set_defaults(func=benchmark_command)
+
+    args = parser.parse_args(argv)
+    if getattr(args, "detector", None) == "yunet" and not (args.yunet_model and os.path.exists(args.yunet_model)):
+        parser.error("--detector yunet needs --yunet-model with the path of the .onnx model file")
+    args.profiler = Profiler() if getattr(args, "profile", None) else None
+    status = args.func(args)
+    if args.profiler is not None:
+        args.profiler.write(args.profile)
+    return status
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        sys.exit(main_cli(sys.argv[1:]))
+
     app = QApplication(sys.argv)
     window = FaceBasedVideoCutter()
     window.show()
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def identity_clip(tmp_path):
+    # 150 frames at 25 fps with one face box that never moves; the person in it
+    # changes every 20 frames and is told apart by the frame's brightness
+    cv2 = pytest.importorskip("cv2")
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (96, 64))
+    for frame in range(150):
+        writer.write(np.full((64, 96, 3), 40 + 50 * ((frame // 20) % 4), dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def clip_person(image):
+    return int(round((image.mean() - 40) / 50))
+
+
+def stub_locate(self, images):
+    return [[(8, 56, 40, 24)] for _ in images]
+
+
+def stub_encode(self, images, locations):
+    return [[np.eye(128)[clip_person(image)] for _ in image_locations]
+            for image, image_locations in zip(images, locations)]
+
+
+@pytest.fixture
+def stub_backend(monkeypatch):
+    # The HOG backend finds the clip's face box and encodes each person as a unit vector
+    cutter = pytest.importorskip("face_based_video_cutter")
+    monkeypatch.setattr(cutter.HogBackend, "locate", stub_locate)
+    monkeypatch.setattr(cutter.HogBackend, "encode", stub_encode)
+    return cutter.HogBackend
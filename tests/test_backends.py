@@ -0,0 +1,59 @@
+import types
+
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("face_recognition")
+pytest.importorskip("dlib")
+pytest.importorskip("PyQt6")
+
+import face_based_video_cutter as cutter
+
+
+def test_make_backend_by_name(tmp_path):
+    assert type(cutter.make_backend()) is cutter.HogBackend
+    assert type(cutter.make_backend("cnn")) is cutter.CnnBackend
+    with pytest.raises(ValueError):
+        cutter.make_backend("yunet")
+    with pytest.raises(ValueError):
+        cutter.make_backend("yunet", str(tmp_path / "missing.onnx"))
+    model_path = tmp_path / "yunet.onnx"
+    model_path.write_bytes(b"")
+    backend = cutter.make_backend("yunet", str(model_path))
+    assert (backend.name, backend.model_path) == ("yunet", str(model_path))
+
+
+def test_cnn_backend_batches_images_of_one_size(monkeypatch):
+    calls = []
+
+    def batch_face_locations(images, batch_size=128):
+        calls.append(len(images))
+        return [[(0, image.shape[1], image.shape[0], 0)] for image in images]
+
+    monkeypatch.setattr(cutter.face_recognition, "batch_face_locations", batch_face_locations)
+    images = [np.zeros((20, 30, 3), np.uint8), np.zeros((40, 50, 3), np.uint8), np.zeros((20, 30, 3), np.uint8)]
+    assert cutter.CnnBackend().locate(images) == [[(0, 30, 20, 0)], [(0, 50, 40, 0)], [(0, 30, 20, 0)]]
+    assert sorted(calls) == [1, 2]
+
+
+def test_encode_face_batch_runs_the_encoder_once(monkeypatch):
+    calls = []
+
+    def compute_face_descriptor(chips):
+        calls.append(len(chips))
+        return [np.full(128, chip) for chip in chips]
+
+    # Each chip is the face's left edge, so encodings show where they came from
+    monkeypatch.setattr(cutter.dlib, "rectangle", lambda left, top, right, bottom: left)
+    monkeypatch.setattr(cutter.face_recognition.api, "pose_predictor_5_point", lambda image, left: left)
+    monkeypatch.setattr(cutter.face_recognition.api, "face_encoder",
+                        types.SimpleNamespace(compute_face_descriptor=compute_face_descriptor))
+    monkeypatch.setattr(cutter.dlib, "get_face_chip", lambda image, left, size=150, padding=0.25: left)
+
+    images = [np.zeros((60, 60, 3), np.uint8)] * 3
+    locations = [[(0, 20, 20, 1), (0, 40, 20, 2)], [], [(0, 30, 20, 3)]]
+    encodings = cutter.encode_face_batch(images, locations)
+    assert calls == [3]
+    assert [[float(encoding[0]) for encoding in frame] for frame in encodings] == [[1, 2], [], [3]]
+    assert cutter.encode_faces(cutter.HogBackend(), images, [[], [], []]) == [[], [], []]
@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("face_recognition")
+pytest.importorskip("dlib")
+pytest.importorskip("PyQt6")
+
+import face_based_video_cutter as cutter
+
+
+def test_encoding_cache_key_and_round_trip(tmp_path):
+    video_path = tmp_path / "video.bin"
+    video_path.write_bytes(b"frames" * 1000)
+    cache = cutter.EncodingCache(str(tmp_path / "cache"))
+    key = cache.key(str(video_path), (5, None, "hog"))
+    assert key == cache.key(str(video_path), (5, None, "hog"))
+    assert key != cache.key(str(video_path), (5, None, "cnn"))
+
+    frame_indices = np.array([0, 5, 5])
+    boxes = np.array([[1, 2, 3, 0], [4, 5, 6, 3], [7, 8, 9, 6]])
+    encodings = np.random.default_rng(4).random((3, 128))
+    cache.store(key, frame_indices, boxes, encodings)
+    loaded = cache.load(key)
+    assert loaded is not None
+    assert np.array_equal(loaded['frame_indices'], frame_indices)
+    assert np.allclose(loaded['encodings'], encodings)
+
+    video_path.write_bytes(b"changed" * 1000)
+    assert cache.key(str(video_path), (5, None, "hog")) != key
+
+
+def test_encoding_cache_ignores_unreadable_entries(tmp_path):
+    cache = cutter.EncodingCache(str(tmp_path))
+    assert cache.load("missing") is None
+    (tmp_path / "broken.npz").write_bytes(b"not a zip file")
+    assert cache.load("broken") is None
+
+
+def test_encoding_cache_evicts_least_recently_used(tmp_path):
+    cache = cutter.EncodingCache(str(tmp_path))
+    encodings = np.zeros((50, 128))
+    cache.store("old", np.arange(50), np.zeros((50, 4)), encodings)
+    # Room for two entries
+    cache.max_bytes = 2 * (tmp_path / "old.npz").stat().st_size
+    cache.store("used", np.arange(50), np.zeros((50, 4)), encodings)
+    old_time = (tmp_path / "old.npz").stat().st_mtime
+    cutter.os.utime(tmp_path / "used.npz", (old_time - 10, old_time - 10))
+    assert cache.load("used") is not None
+
+    cache.store("new", np.arange(50), np.zeros((50, 4)), encodings)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["new.npz", "used.npz"]
+
+
+def people(result):
+    frame_indices = result['detections'].frame_indices
+    return sorted(tuple(frame_indices[person['indices']].tolist()) for person in result['unique_faces'])
+
+
+def test_resumed_pass_equals_uninterrupted_pass(tmp_path, identity_clip, stub_backend):
+    video_path = identity_clip
+    options = dict(face_tolerance=0.5, sample_interval=2, workers=1, tracking=False, motion_gating=False)
+
+    full = cutter.FaceDetector(video_path, **options).run()
+    assert len(full['unique_faces']) == 4
+
+    detector = None
+
+    def stop_midway(done, total, stages):
+        if done > total // 2:
+            detector.stop()
+
+    cache = cutter.EncodingCache(str(tmp_path / "cache"))
+    detector = cutter.FaceDetector(video_path, cache=cache, progress_callback=stop_midway, **options)
+    partial = detector.run()
+    assert partial['stats']['partial']
+    assert len(partial['detections']) < len(full['detections'])
+
+    resumed = cutter.FaceDetector(video_path, cache=cache, **options).run()
+    assert resumed['stats']['resumed_from'] == partial['stats']['last_frame'] + 1
+    assert not resumed['stats']['partial']
+    assert np.array_equal(resumed['detections'].frame_indices, full['detections'].frame_indices)
+    assert people(resumed) == people(full)
+
+    cached = cutter.FaceDetector(video_path, cache=cache, **options).run()
+    assert cached['stats']['cached']
+    assert people(cached) == people(full)
+
+
+def test_journal_drops_rows_written_after_the_checkpoint(tmp_path):
+    clusterer = cutter.IdentityClusterer(0.5)
+    clusterer.assign(np.eye(128)[:2])
+    journal = cutter.DetectionJournal(str(tmp_path), "key")
+    journal.open()
+    journal.append([0, 0], [0, 1], np.zeros((2, 4)), np.eye(128)[:2])
+    journal.checkpoint(4, clusterer)
+    # Rows of frames processed after the checkpoint, then a crash
+    journal.append([6], [0], np.zeros((1, 4)), np.eye(128)[:1])
+    journal.file.flush()
+
+    rows, checkpoint = cutter.DetectionJournal(str(tmp_path), "key").load()
+    assert rows['frame'].tolist() == [0, 0]
+    assert int(checkpoint['last_frame']) == 4
+    assert len(checkpoint['centroids']) == 2
+    journal.close()
+
+    (tmp_path / "key.journal").write_bytes(b"")
+    assert cutter.DetectionJournal(str(tmp_path), "key").load() is None
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("face_recognition")
+pytest.importorskip("dlib")
+pytest.importorskip("PyQt6")
+
+import face_based_video_cutter as cutter
+
+
+def unit(index):
+    return np.eye(128)[index]
+
+
+def test_assign_matches_people_and_creates_new_ones():
+    clusterer = cutter.IdentityClusterer(0.5)
+    assert clusterer.assign([unit(0), unit(1)]).tolist() == [0, 1]
+    # Within one batch a new face can join a person created earlier in it
+    assert clusterer.assign([unit(2), unit(0) * 0.9, unit(2) * 0.9]).tolist() == [2, 0, 2]
+    assert clusterer.counts[:clusterer.size].tolist() == [2, 1, 2]
+    assert np.allclose(clusterer.centroids[0], unit(0) * 0.95)
+
+
+def test_merge_joins_people_closer_than_the_tolerance():
+    clusterer = cutter.IdentityClusterer(0.3)
+    clusterer.restore(np.array([unit(0), unit(1), unit(0) * 0.8, unit(1) * 0.9]), np.array([1, 1, 3, 1]))
+    mapping = clusterer.merge()
+    assert mapping.tolist() == [0, 1, 0, 1]
+    assert clusterer.size == 2
+    assert np.allclose(clusterer.centroids[0], unit(0) * 0.85)
+    assert clusterer.counts[:2].tolist() == [4, 2]
+
+
+def test_blocked_merge_matches_dense_distances():
+    rng = np.random.default_rng(5)
+    centroids = rng.normal(size=(300, 128)) * 0.05
+    for tolerance in (0.6, 0.7, 0.72, 0.75):
+        distances = np.linalg.norm(centroids[:, None] - centroids[None], axis=2)
+        expected = cutter.connected_components(300, np.argwhere(np.triu(distances <= tolerance, k=1)))
+        for block_size in (1, 7, 300):
+            clusterer = cutter.IdentityClusterer(tolerance)
+            clusterer.restore(centroids, np.ones(300, dtype=np.int64))
+            assert np.array_equal(clusterer.merge(block_size=block_size), expected)
+
+
+def test_regrouper_matches_per_frame_clustering():
+    rng = np.random.default_rng(3)
+    centers = rng.normal(size=(5, 128))
+    centers *= 0.4 / np.linalg.norm(centers, axis=1)[:, None]
+    frame_indices, encodings = [], []
+    for frame in range(200):
+        for person in rng.choice(5, size=rng.integers(0, 4), replace=False):
+            frame_indices.append(frame)
+            encodings.append(centers[person] + rng.normal(scale=0.02, size=128))
+    frame_indices, encodings = np.array(frame_indices), np.array(encodings)
+
+    for merge in (False, True):
+        regrouper = cutter.Regrouper(frame_indices, encodings, merge)
+        for tolerance in (0.2, 0.5, 0.8):
+            clusterer = cutter.IdentityClusterer(tolerance)
+            labels = np.concatenate([clusterer.assign(encodings[frame_indices == frame])
+                                     for frame in np.unique(frame_indices)])
+            if merge:
+                labels = clusterer.merge()[labels]
+            cut_labels, centroids = regrouper.cut(tolerance)
+            assert np.array_equal(cut_labels, labels)
+            assert np.allclose(centroids, clusterer.centroids[:clusterer.size])
+            people = regrouper.people(tolerance)
+            assert sorted(index for person in people for index in person['indices']) == list(range(len(labels)))
@@ -0,0 +1,169 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("face_recognition")
+pytest.importorskip("dlib")
+pytest.importorskip("PyQt6")
+
+import face_based_video_cutter as cutter
+
+
+def gray_frame(level, size=(64, 96)):
+    return np.full(size + (3,), level, dtype=np.uint8)
+
+
+def people_identities(result, frames_per_person=20):
+    # The clip identities each person was built from, with their detection counts
+    frame_indices = result['detections'].frame_indices
+    return sorted((sorted({int(frame) // frames_per_person % 4 for frame in frame_indices[person['indices']]}),
+                   len(person['indices'])) for person in result['unique_faces'])
+
+
+class SquareBackend(cutter.HogBackend):
+    # Finds the bright square of square_frames and encodes it by its brightness.
+    # Defined here rather than patched in, so pool workers can unpickle it.
+    name = "square"
+
+    def locate(self, images):
+        locations = []
+        for image in images:
+            rows, columns = np.nonzero(image[:, :, 0] > 100)
+            locations.append([(int(rows.min()), int(columns.max()) + 1, int(rows.max()) + 1, int(columns.min()))]
+                             if len(rows) else [])
+        return locations
+
+    def encode(self, images, locations):
+        return [[np.full(128, image[top:bottom, left:right].mean() / 255.0) for top, right, bottom, left in boxes]
+                for image, boxes in zip(images, locations)]
+
+
+def square_frames(count=40):
+    # Engine input: a square drifting right, brighter after the cut at frame 20,
+    # and every fourth frame inherited from the one before
+    for frame in range(count):
+        image = np.full((64, 96, 3), 30, dtype=np.uint8)
+        left = 8 + frame
+        image[20:36, left:left + 16] = 150 if frame < 20 else 250
+        yield frame, (64, 96), image if frame % 4 != 3 else None, frame == 20
+
+
+def test_tracker_reuses_encodings_of_a_steady_face():
+    tracker = cutter.FaceTracker(refresh_interval=3)
+    image = gray_frame(90)
+    needed = []
+    encodings = []
+    for step in range(5):
+        plan, to_encode = tracker.plan([(10, 50, 50, 10)], image)
+        needed.append(len(to_encode))
+        encodings.append(tracker.commit(plan, [np.full(128, step)] * len(to_encode))[0][0])
+    assert needed == [1, 0, 0, 1, 0]
+    assert encodings == [0, 0, 0, 3, 3]
+    assert (tracker.encoded, tracker.reused) == (2, 3)
+
+
+def test_tracker_reencodes_when_someone_else_takes_the_box():
+    tracker = cutter.FaceTracker()
+    plan, to_encode = tracker.plan([(10, 50, 50, 10)], gray_frame(40))
+    tracker.commit(plan, [np.zeros(128)])
+    plan, to_encode = tracker.plan([(10, 50, 50, 10)], gray_frame(190))
+    assert to_encode == [(10, 50, 50, 10)]
+    assert tracker.commit(plan, [np.ones(128)])[0][0] == 1
+    plan, to_encode = tracker.plan([(12, 52, 52, 12)], gray_frame(190))
+    assert to_encode == []
+
+
+def test_tracker_drops_tracks_on_reset():
+    tracker = cutter.FaceTracker()
+    tracker.commit(tracker.plan([(10, 50, 50, 10)], gray_frame(40))[0], [np.zeros(128)])
+    tracker.reset()
+    plan, to_encode = tracker.plan([(10, 50, 50, 10)], gray_frame(40))
+    assert to_encode == [(10, 50, 50, 10)]
+
+
+def test_tracking_keeps_identities_in_a_fixed_box(identity_clip, stub_backend):
+    result = cutter.FaceDetector(identity_clip, 0.05, sample_interval=2, merge_clusters=False, workers=1,
+                                 tracking=True, motion_gating=False).run()
+    assert people_identities(result) == [([0], 20), ([1], 20), ([2], 20), ([3], 15)]
+    assert result['stats']['encodings_reused'] > 0
+
+
+def test_motion_gate_inherits_static_frames_and_flags_cuts():
+    gate = cutter.MotionGate(dense_samples=0)
+    checks = []
+    for level in [40] * 5 + [200] * 5:
+        changed = gate.check(gray_frame(level))
+        checks.append((changed, gate.scene_cut))
+    assert checks[0] == (True, False)
+    assert all(check == (False, False) for check in checks[1:5])
+    assert checks[5] == (True, True)
+    assert gate.scene_cuts == 1
+    assert gate.inherited == 8
+
+
+def test_region_planner_scans_in_full_after_a_reset():
+    regions = cutter.RegionPlanner(full_scan_interval=10)
+    shape = (360, 640, 3)
+    scan = regions.plan(shape)
+    assert scan[0] is None
+    regions.update(scan, [(100, 200, 160, 140)])
+    stale = regions.plan(shape)
+    assert stale[0] is not None
+
+    regions.reset()
+    scan = regions.plan(shape)
+    assert scan[0] is None
+    regions.update(stale, [(0, 60, 60, 0)])
+    regions.update(scan, [(200, 400, 260, 340)])
+    assert regions.boxes == [(200, 400, 260, 340)]
+
+
+def test_detection_scale_fits_the_pixel_budget_or_the_face_size():
+    assert cutter.detection_scale(1920, 1080) == pytest.approx(1 / 3)
+    assert cutter.detection_scale(320, 240) == 1.0
+    assert cutter.detection_scale(1920, 1080, target_face_size=160) == pytest.approx(0.25)
+
+
+def test_region_planner_searches_padded_regions_until_a_face_is_lost():
+    regions = cutter.RegionPlanner(full_scan_interval=3, margin=0.5, min_padding=10)
+    shape = (360, 640, 3)
+    regions.update(regions.plan(shape), [(100, 140, 140, 100), (110, 160, 150, 120), (300, 600, 340, 560)])
+    scan = regions.plan(shape)
+    # The two faces on the left overlap once padded and share one region
+    assert scan[:2] == ([(80, 180, 170, 80), (280, 620, 360, 540)], 3)
+
+    regions.update(scan, [(100, 140, 140, 100)])
+    assert regions.plan(shape)[0] is None
+    assert (regions.full_scans, regions.region_scans) == (2, 1)
+
+
+def test_region_search_reports_faces_in_frame_coordinates():
+    image = np.full((64, 96, 3), 30, dtype=np.uint8)
+    image[20:36, 50:66] = 200
+    located = cutter.locate_faces(SquareBackend(), [image, image], regions=[[(10, 80, 50, 40)], None])
+    assert located == [[(20, 66, 36, 50)], [(20, 66, 36, 50)]]
+
+
+def test_scene_cuts_reset_tracks(identity_clip, stub_backend):
+    # The face box never moves, so only the cuts keep one person's encoding from another
+    result = cutter.FaceDetector(identity_clip, 0.05, sample_interval=2, merge_clusters=False, workers=1,
+                                 tracking=True, motion_gating=True).run()
+    assert result['stats']['scene_cuts'] == 7
+    assert people_identities(result) == [([0], 20), ([1], 20), ([2], 20), ([3], 15)]
+
+
+@pytest.mark.parametrize("tracking", [False, True])
+def test_engine_pool_matches_inline(tracking):
+    # Not in ROI mode: the pool plans regions before earlier batches are located
+    results = []
+    for workers in (1, 2):
+        tracker = cutter.FaceTracker() if tracking else None
+        with cutter.DetectionEngine(workers, backend=SquareBackend(), batch_size=3) as engine:
+            results.append([(frame_index, locations, [float(encoding[0]) for encoding in encodings])
+                            for frame_index, _, locations, encodings in engine.process(square_frames(), tracker)])
+    inline, pooled = results
+    assert pooled == inline
+    assert [frame_index for frame_index, _, _ in inline] == list(range(40))
+    assert inline[3][1:] == inline[2][1:]
+    assert inline[19][2] == [pytest.approx(150 / 255)]
+    assert inline[20][2] == [pytest.approx(250 / 255)]
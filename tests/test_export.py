@@ -0,0 +1,127 @@
+import subprocess
+
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("face_recognition")
+pytest.importorskip("dlib")
+pytest.importorskip("PyQt6")
+
+import face_based_video_cutter as cutter
+
+
+def test_split_ranges_keeps_every_frame_in_order():
+    ranges = [(0, 9), (20, 24), (30, 30), (40, 61)]
+    for chunks in range(1, 8):
+        groups = cutter.split_ranges(ranges, chunks)
+        assert len(groups) <= chunks
+        flat = [frame for group in groups for start, end in group for frame in range(start, end + 1)]
+        assert flat == [frame for start, end in ranges for frame in range(start, end + 1)]
+        sizes = [sum(end - start + 1 for start, end in group) for group in groups]
+        assert max(sizes) - min(sizes) <= max(sizes) // 2 + 1
+
+
+@pytest.mark.parametrize("frame_accurate", [False, True])
+def test_keyframe_pieces_copy_between_keyframes(frame_accurate):
+    fps = 25
+    rng = np.random.default_rng(2)
+    for _ in range(300):
+        gop = int(rng.integers(5, 40))
+        keyframe_frames = set(range(0, 600, gop))
+        keyframes = [frame / fps for frame in sorted(keyframe_frames)]
+        bounds = sorted(rng.choice(600, size=2 * int(rng.integers(1, 4)), replace=False).tolist())
+        ranges = list(zip(bounds[::2], bounds[1::2]))
+        frames = {frame for start, end in ranges for frame in range(start, end + 1)}
+
+        pieces = cutter.keyframe_pieces(ranges, fps, keyframes, frame_accurate)
+        pieces_frames = []
+        for start, end, reencode in pieces:
+            start_frame, end_frame = round(start * fps), round(end * fps)
+            if not reencode:
+                assert start_frame in keyframe_frames
+                assert end_frame in keyframe_frames or end_frame > max(keyframe_frames)
+            pieces_frames.extend(range(start_frame, end_frame))
+        assert len(pieces_frames) == len(set(pieces_frames))
+        if frame_accurate:
+            assert set(pieces_frames) == frames
+        else:
+            assert not any(reencode for _, _, reencode in pieces)
+            assert set(pieces_frames) >= frames
+
+
+def test_probe_keyframes_counts_from_the_stream_start(monkeypatch):
+    packets = "1.400000,K_\n1.440000,__\n2.400000,K_\nN/A,K_\n"
+
+    def run(*args, **kwargs):
+        return subprocess.CompletedProcess(args, 0, stdout=packets)
+
+    monkeypatch.setattr(cutter.subprocess, "run", run)
+    assert cutter.probe_keyframes("video.mp4", start_time=1.4) == pytest.approx([0.0, 1.0])
+
+
+def test_boundary_encoder_matches_the_source_parameters():
+    stream = {'codec_name': 'h264', 'profile': 'High', 'level': 41, 'pix_fmt': 'yuv420p', 'refs': 4}
+    arguments = cutter.boundary_encoder(stream)
+    options = dict(zip(arguments[::2], arguments[1::2]))
+    assert options == {'-c:v': 'libx264', '-profile:v': 'high', '-level': '4.1', '-refs': '4', '-bf': '0',
+                       '-pix_fmt': 'yuv420p'}
+
+    stream = {'codec_name': 'hevc', 'profile': 'Main 10', 'level': 120, 'pix_fmt': 'yuv420p10le', 'refs': 1}
+    arguments = cutter.boundary_encoder(stream)
+    assert arguments[arguments.index("-profile:v") + 1] == 'main10'
+    assert "level-idc=4.0" in arguments[arguments.index("-x265-params") + 1]
+
+
+@pytest.mark.parametrize("stream", [
+    {'codec_name': 'h264', 'profile': 'High 4:4:4 Intra', 'level': 40, 'pix_fmt': 'yuv444p'},
+    {'codec_name': 'h264', 'profile': 'High', 'level': 40},
+    {'codec_name': 'hevc', 'profile': 'Rext', 'level': 120, 'pix_fmt': 'yuv444p'},
+    {'codec_name': 'mpeg4', 'profile': 'Simple Profile', 'level': 1, 'pix_fmt': 'yuv420p'},
+])
+def test_boundary_encoder_rejects_unmatched_streams(stream):
+    assert cutter.boundary_encoder(stream) is None
+
+
+def test_stream_copy_export_seeks_from_the_file_start(monkeypatch, tmp_path):
+    stream = {'codec_name': 'h264', 'profile': 'Main', 'level': 30, 'pix_fmt': 'yuv420p', 'refs': 2,
+              'start_time': 0.5, 'file_start_time': 0.25}
+    commands = []
+
+    def run_ffmpeg(arguments, is_running):
+        commands.append(arguments)
+        return True
+
+    monkeypatch.setattr(cutter, "probe_video_stream", lambda video_path: stream)
+    monkeypatch.setattr(cutter, "probe_keyframes", lambda video_path, start_time: [0.0, 1.0, 2.0])
+    monkeypatch.setattr(cutter, "run_ffmpeg", run_ffmpeg)
+    monkeypatch.setattr(cutter, "concat_files", lambda paths, output_path, is_running: True)
+
+    assert cutter.stream_copy_export("video.mp4", str(tmp_path / "out.mp4"), [(10, 59)], 20, True)
+    seeks = [float(arguments[arguments.index("-ss") + 1]) for arguments in commands]
+    assert seeks == pytest.approx([0.75, 1.25, 2.25])
+    assert ["-profile:v" in arguments for arguments in commands] == [True, False, True]
+
+    stream['profile'] = 'High 4:4:4 Intra'
+    with pytest.raises(RuntimeError):
+        cutter.stream_copy_export("video.mp4", str(tmp_path / "out.mp4"), [(10, 59)], 20, True)
+
+
+@pytest.mark.parametrize("ffmpeg", [None, "/usr/bin/ffmpeg"])
+def test_export_runs_in_parallel_only_with_ffmpeg(monkeypatch, tmp_path, identity_clip, ffmpeg):
+    calls = []
+
+    def parallel_export(*args, **kwargs):
+        calls.append(args)
+        return True
+
+    monkeypatch.setattr(cutter.shutil, "which", lambda name: ffmpeg)
+    monkeypatch.setattr(cutter, "MIN_CHUNK_FRAMES", 10)
+    monkeypatch.setattr(cutter, "parallel_export", parallel_export)
+    output_path = str(tmp_path / "out.avi")
+    assert cutter.export_video(identity_clip, output_path, [(0, 49), (80, 129)], "MJPG", workers=2)
+    assert len(calls) == (1 if ffmpeg else 0)
+    if not ffmpeg:
+        cap = cutter.cv2.VideoCapture(output_path)
+        assert int(cap.get(cutter.cv2.CAP_PROP_FRAME_COUNT)) == 100
+        cap.release()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("face_recognition")
+pytest.importorskip("dlib")
+pytest.importorskip("PyQt6")
+
+import face_based_video_cutter as cutter
+
+
+def unit(index, scale=1.0):
+    return np.eye(128)[index] * scale
+
+
+def test_register_keeps_ids_across_videos(tmp_path):
+    index = cutter.PersonIndex(str(tmp_path))
+    assert index.register("a.mp4", [unit(0), unit(1)], 0.5).tolist() == [0, 1]
+    assert index.register("b.mp4", [unit(2), unit(1) * 1.1], 0.5).tolist() == [2, 1]
+    assert index.videos_with([1]) == [cutter.os.path.abspath("a.mp4"), cutter.os.path.abspath("b.mp4")]
+    assert index.videos_with([2]) == [cutter.os.path.abspath("b.mp4")]
+
+    reloaded = cutter.PersonIndex(str(tmp_path))
+    assert len(reloaded) == 3
+    assert reloaded.counts.tolist() == [1, 2, 1]
+    assert np.allclose(reloaded.centroids[1], unit(1) * 1.05)
+
+
+def test_people_of_one_video_get_different_ids(tmp_path):
+    index = cutter.PersonIndex(str(tmp_path))
+    index.register("a.mp4", [unit(0)], 0.6)
+    # Both are within tolerance of person 0; the closer one keeps the ID
+    ids = index.register("b.mp4", [unit(0) + unit(1, 0.4), unit(0) + unit(1, 0.2)], 0.6)
+    assert ids.tolist() == [1, 0]
+    assert index.lookup([unit(0) + unit(1, 0.4), unit(0) + unit(1, 0.2)], 0.6).tolist() == [1, 0]
+
+
+@pytest.mark.parametrize("damaged", ["videos.json", "centroids.npy"])
+def test_unreadable_index_starts_empty(tmp_path, damaged):
+    index = cutter.PersonIndex(str(tmp_path))
+    index.register("a.mp4", [unit(0), unit(1)], 0.5)
+    path = tmp_path / damaged
+    path.write_bytes(path.read_bytes()[:len(path.read_bytes()) // 2])
+
+    index = cutter.PersonIndex(str(tmp_path))
+    assert len(index) == 0 and index.videos == {}
+    assert index.register("b.mp4", [unit(2)], 0.5).tolist() == [0]
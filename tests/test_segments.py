@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+pytest.importorskip("face_recognition")
+pytest.importorskip("dlib")
+pytest.importorskip("PyQt6")
+
+import face_based_video_cutter as cutter
+
+
+def random_segments(rng, total=200):
+    frames = np.flatnonzero(rng.random(total) < rng.random())
+    return cutter.SegmentList.from_frames(frames), set(frames.tolist())
+
+
+def covered(segments):
+    return {frame for start, end in segments.ranges() for frame in range(start, end + 1)}
+
+
+def assert_canonical(segments):
+    # Sorted, disjoint and not touching
+    ranges = segments.ranges()
+    assert all(start <= end for start, end in ranges)
+    assert all(previous[1] + 1 < current[0] for previous, current in zip(ranges, ranges[1:]))
+
+
+def test_merge_runs_joins_overlapping_touching_and_close_runs():
+    starts, ends = cutter.merge_runs([10, 0, 4, 30], [12, 3, 6, 31], merge_gap=2)
+    assert list(zip(starts.tolist(), ends.tolist())) == [(0, 6), (10, 12), (30, 31)]
+    starts, ends = cutter.merge_runs([0, 8], [5, 9], merge_gap=2)
+    assert list(zip(starts.tolist(), ends.tolist())) == [(0, 9)]
+
+
+def test_segment_algebra_matches_frame_sets():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        lists = [random_segments(rng) for _ in range(rng.integers(1, 4))]
+        union = cutter.SegmentList.union(*[segments for segments, _ in lists])
+        intersection = cutter.SegmentList.intersection(*[segments for segments, _ in lists])
+        assert covered(union) == set.union(*[frames for _, frames in lists])
+        assert covered(intersection) == set.intersection(*[frames for _, frames in lists])
+        assert_canonical(union)
+        assert_canonical(intersection)
+
+
+def test_from_frames_spans_the_sample_interval():
+    segments = cutter.SegmentList.from_frames([0, 5, 10, 30], sample_interval=5, total_frames=32)
+    assert segments.ranges() == [(0, 14), (30, 31)]
+    assert segments.frame_count() == 17
+
+
+def runs_of(frames, merge_gap=0):
+    runs = []
+    for frame in sorted(frames):
+        if runs and frame - runs[-1][1] - 1 <= merge_gap:
+            runs[-1][1] = frame
+        else:
+            runs.append([frame, frame])
+    return [tuple(run) for run in runs]
+
+
+def test_padded_matches_frame_sets():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        segments, frames = random_segments(rng)
+        padding, merge_gap = int(rng.integers(0, 5)), int(rng.integers(0, 5))
+        expected = {frame + offset for frame in frames for offset in range(-padding, padding + 1)
+                    if 0 <= frame + offset < 200}
+        assert segments.padded(padding, merge_gap, total_frames=200).ranges() == runs_of(expected, merge_gap)
+
+
+def test_timeline_selects_people_any_or_together():
+    frame_indices = np.array([0, 0, 10, 20, 20, 40])
+    detections = cutter.DetectionTable.from_arrays(frame_indices, np.zeros((6, 4)), np.zeros((6, 128)))
+    unique_faces = [{'indices': [0, 2, 3]}, {'indices': [1, 4, 5]}]
+    timeline = cutter.PersonTimeline(detections, unique_faces, sample_interval=10, total_frames=45)
+    assert timeline.person(0).ranges() == [(0, 29)]
+    assert timeline.select([0, 1]).ranges() == [(0, 29), (40, 44)]
+    assert timeline.select([0, 1], together=True).ranges() == [(0, 9), (20, 29)]